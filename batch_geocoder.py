@@ -0,0 +1,145 @@
+"""
+batch_geocoder.py
+Concurrent, rate-limited, resumable geocoding of many places
+~ * ~ * ~ * ~ *
+lookups run in worker threads, at most `concurrency` at a time
+a token bucket keeps requests under the provider's rate limit
+timeouts and unavailable/rate-limited responses are retried with exponential backoff
+every finished lookup is appended to a journal, so a crashed run resumes where it stopped
+"""
+import asyncio
+import json
+import time
+from pathlib import Path
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited, GeocoderServiceError
+
+TRANSIENT_ERRORS = (GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited)
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, with bursts of up to `burst` requests
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def make_geocoder(domain="nominatim.openstreetmap.org", scheme="https", user_agent="sensus", timeout=10):
+    """
+    :param domain: geocoding service host (ex: "localhost:8080" for a local stand-in)
+    :param scheme: "https" or "http"
+    :param user_agent: user agent string sent to the service
+    :param timeout: seconds to wait for each response
+    :return: function place -> [lat, long] or None
+    """
+    geolocator = Nominatim(user_agent=user_agent, domain=domain, scheme=scheme, timeout=timeout)
+
+    def geocode(place):
+        location = geolocator.geocode(place)
+        if location is None:
+            return None
+        return [location.latitude, location.longitude]
+    return geocode
+
+
+def read_journal(journal_path):
+    """
+    :param journal_path: path to a JSON-lines journal written by geocode_batch(), or None
+    :return: dictionary place -> [lat, long] or None for every place already looked up
+    """
+    done = {}
+    if journal_path is None or not Path(journal_path).exists():
+        return done
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # last line cut off by a crash
+                continue
+            done[entry["place"]] = entry["coordinates"]
+    return done
+
+
+async def geocode_batch(places, geocode, concurrency=2, rate=1.0, burst=1, retries=3, backoff=1.0,
+                        journal_path=None):
+    """
+    :param places: iterable of place strings (duplicates are looked up once)
+    :param geocode: function place -> [lat, long] or None (see make_geocoder())
+    :param concurrency: maximum number of lookups in flight
+    :param rate: maximum requests per second
+    :param burst: maximum requests sent back to back
+    :param retries: retries after a transient error
+    :param backoff: seconds to wait before the first retry, doubled for each later retry
+    :param journal_path: JSON-lines file to append results to and resume from, or None
+    :return: (dictionary place -> [lat, long] or None, dictionary place -> error string for failed places)
+    """
+    results = read_journal(journal_path)
+    pending = [p for p in dict.fromkeys(places) if p not in results]
+    if results:
+        print("Resuming: {} places already in the journal, {} to go".format(len(results), len(pending)))
+    failed = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate, burst)
+    journal = open(journal_path, 'a', encoding='utf-8') if journal_path is not None else None
+
+    async def lookup(place):
+        async with semaphore:
+            for attempt in range(retries + 1):
+                await bucket.acquire()
+                try:
+                    coordinates = await asyncio.to_thread(geocode, place)
+                except TRANSIENT_ERRORS as e:
+                    if attempt == retries:
+                        failed[place] = "{}: {}".format(type(e).__name__, e)
+                        return
+                    wait = backoff * 2 ** attempt
+                    if isinstance(e, GeocoderRateLimited) and e.retry_after:
+                        wait = max(wait, e.retry_after)
+                    await asyncio.sleep(wait)
+                    continue
+                except GeocoderServiceError as e:  # not worth retrying (ex: bad request, no permission)
+                    failed[place] = "{}: {}".format(type(e).__name__, e)
+                    return
+                results[place] = coordinates
+                if journal is not None:
+                    journal.write(json.dumps({"place": place, "coordinates": coordinates}) + "\n")
+                    journal.flush()
+                return
+
+    try:
+        await asyncio.gather(*(lookup(p) for p in pending))
+    finally:
+        if journal is not None:
+            journal.close()
+    return results, failed
+
+
+def run_batch(places, geocode=None, **kwargs):
+    """
+    Synchronous wrapper for geocode_batch()
+    :param places: iterable of place strings
+    :param geocode: function place -> [lat, long] or None (defaults to make_geocoder())
+    :param kwargs: keyword arguments for geocode_batch()
+    :return: (dictionary place -> [lat, long] or None, dictionary place -> error string)
+    """
+    geocode = geocode or make_geocoder()
+    start = time.perf_counter()
+    results, failed = asyncio.run(geocode_batch(places, geocode, **kwargs))
+    print("Geocoded {} places ({} failed) in {:.1f}s".format(len(results), len(failed), time.perf_counter() - start))
+    return results, failed
@@ -7,10 +7,13 @@ import helpers as hp
 import pandas as pd
 import numpy as np
 import state_names as sn
+import normalization as nz
+import geography as geo
+import county_matcher as cm
 
 
 def get_county(cell, ver):
-    name = np.NaN
+    name = np.nan
     if "County" in cell:
         cell = cell.split(" ")
         for i in range(len(cell)):
@@ -19,7 +22,6 @@ def get_county(cell, ver):
                     name = " ".join(cell[:i])
                 elif ver == 2:
                     name = cell[i-1]
-    print("Setting", name)
     return name
 
 
@@ -32,19 +34,25 @@ def find_county_name(f_name, path_to_data):
     Find county name from "Entity" and "Government" columns in excel sheet of opposed projects
     :param f_name: name of Bryce starting database
     :param path_to_data: path to location of file
-    :return: None
+    :return: pandas dataframe of the projects with County and State, plus CountyID, County_match and match_score
+    when the county registry exists
     """
     data = hp.check_path_and_load_data(f_name, path_to_data)
     # If Entity column contains "Township", find county in Government column
     temp = data[data['Entity'].str.contains("Township")]
-    data['County'] = temp['Government'].apply(get_county, ver=2)
+    data['County'] = nz.get_county(temp['Government'], ver=2)
     # Else, find county in Entity column
     temp = data[data['County'].isnull()]
-    data['County'] = temp['Entity'].apply(get_county, ver=1)
+    data['County'] = nz.get_county(temp['Entity'], ver=1)
     data['State'] = data['State'].apply(update_state)
+    # Resolve every record to a county ID: exact match on the extracted county, else trigram fuzzy match
+    # over the County, Government and Entity strings within the record's state
+    registry = geo.load_registry(path_to_data)
+    if registry is not None:
+        data = cm.resolve_counties(data, registry)
     # Don't rerun
     #hp.save_csv("opposed_projects_partially_filled.csv", data, path_to_data)
-    return
+    return data
 
 
 def main():
@@ -0,0 +1,97 @@
+"""
+contingency.py
+Contingency tables of categorical features against the in-service indicator
+~ * ~ * ~ * ~ *
+each feature is factorized to integer codes once
+a feature set's cells are the combined codes of its features, counted per indicator value with one np.bincount
+joint, marginal and conditional probabilities (optionally Laplace smoothed) come from those counts
+tables are cached per feature set and smoothing, so repeated queries on the same data are free
+"""
+import numpy as np
+import pandas as pd
+
+TARGET = "indicator"
+
+
+class ContingencyEngine:
+    """
+    Probabilities of feature values and the binary target (1 = in service, 0 = withdrawn) for one data set
+    """
+    def __init__(self, merged_data, target=TARGET):
+        """
+        :param merged_data: pandas df with categorical feature columns and the target column
+        :param target: 0/1 target column
+        """
+        self.data = merged_data
+        self.target = merged_data[target].to_numpy(dtype=np.int64)
+        if len(self.target) and not np.isin(self.target, [0, 1]).all():
+            raise ValueError("{} must only hold 0 and 1".format(target))
+        self.codes = {}  # feature -> (codes, sorted values)
+        self.tables = {}  # (features, alpha) -> table
+
+    def feature_codes(self, feature):
+        """
+        :param feature: column name
+        :return: (numpy array of codes, -1 where missing; pandas Index of the sorted values)
+        """
+        if feature not in self.codes:
+            self.codes[feature] = pd.factorize(self.data[feature], sort=True)
+        return self.codes[feature]
+
+    def counts(self, features):
+        """
+        :param features: tuple of column names
+        :return: (K x 2 numpy array of withdrawn/in-service counts per cell, pandas Index/MultiIndex of the K cells)
+        rows with a missing value in any of the features are left out
+        """
+        codes, values = zip(*(self.feature_codes(f) for f in features))
+        shape = tuple(len(v) for v in values)
+        if len(features) == 1:
+            index = pd.Index(values[0], name=features[0])
+        else:
+            index = pd.MultiIndex.from_product([list(v) for v in values], names=list(features))
+        n_cells = int(np.prod(shape))
+        if n_cells == 0:  # a feature with no values at all
+            return np.zeros((0, 2), dtype=np.int64), index
+        keep = np.logical_and.reduce([c >= 0 for c in codes])
+        cell = np.ravel_multi_index([c[keep] for c in codes], shape)
+        table = np.bincount(cell * 2 + self.target[keep], minlength=n_cells * 2).reshape(n_cells, 2)
+        return table, index
+
+    def table(self, features, alpha=0.0):
+        """
+        :param features: column name or list of column names
+        :param alpha: Laplace smoothing pseudo-count added to every cell (0 for raw frequencies)
+        :return: pandas df with one row per combination of feature values:
+        n, n_success (in service), p_x (marginal), p_x_and_success (joint), p_success_given_x,
+        p_x_given_success and p_x_given_withdrawn
+        """
+        features = (features,) if isinstance(features, str) else tuple(features)
+        key = (features, alpha)
+        if key in self.tables:
+            return self.tables[key]
+        counts, index = self.counts(features)
+        counts = counts.astype(np.float64)
+        n_cells = len(counts)
+        withdrawn, success = counts[:, 0], counts[:, 1]
+        n = withdrawn + success
+        total = n.sum()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            table = pd.DataFrame({
+                "n": n.astype(np.int64),
+                "n_success": success.astype(np.int64),
+                "p_x": (n + alpha) / (total + alpha * n_cells),
+                "p_x_and_success": (success + alpha) / (total + 2 * alpha * n_cells),
+                "p_success_given_x": (success + alpha) / (n + 2 * alpha),
+                "p_x_given_success": (success + alpha) / (success.sum() + alpha * n_cells),
+                "p_x_given_withdrawn": (withdrawn + alpha) / (withdrawn.sum() + alpha * n_cells),
+            }, index=index)
+        self.tables[key] = table
+        return table
+
+    def p_success(self, alpha=0.0):
+        """
+        :param alpha: Laplace smoothing pseudo-count
+        :return: marginal probability that a project is in service
+        """
+        return (self.target.sum() + alpha) / (len(self.target) + 2 * alpha)
@@ -11,30 +11,165 @@ save file
 import certifi
 import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
+import json
+import os
+import re
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-from datetime import datetime
+from geopy.exc import GeocoderServiceError
+from datetime import datetime, timedelta
 import helpers as hp
+import county_gazetteer as gz
+import batch_geocoder as bg
 
-def geo(place, mapbox_orientation=True):
+GEO_CACHE_NAME = "geocode_cache.json"
+MISS_RETRY_AFTER = timedelta(days=30)  # wait this long before asking the service again about a place it couldn't find
+_geolocator = None
+
+
+def get_geolocator():
+    """
+    :return: Nominatim client shared by every lookup in this process
+    """
+    global _geolocator
+    if _geolocator is None:
+        _geolocator = Nominatim(user_agent=datetime.now().strftime('mygeo_%H-%M-%S'))
+    return _geolocator
+
+
+def geo(place, mapbox_orientation=True, gazetteer=None):
     """
     Call geopy geocoder API to get coordinates
+    If a gazetteer is given, "<County>, <State>" places are resolved offline first and the API is only a fallback
     :param place: string name of county (or address more generally) to lookup
     :param mapbox_orientation: bool to flip longitude and latitude (Mapbox stores these backwards as lat,long)
-    :return: list [long, lat] or [lat, long] or None
+    :param gazetteer: dictionary from county_gazetteer.load_gazetteer(), or None
+    :return: list [long, lat] or [lat, long], or None if the place wasn't found
+    Raises geopy.exc.GeocoderServiceError (ex: GeocoderTimedOut) if the service didn't answer
     """
-    name = datetime.now().strftime('mygeo_%H-%M-%S')
-    geolocator = Nominatim(user_agent=name)
-    try:
-        location = geolocator.geocode(place)
-        if mapbox_orientation:
-            return [location.longitude, location.latitude]
-        else:
-            return [location.latitude, location.longitude]
-    except:
+    if gazetteer is not None:
+        coordinates = gz.geocode_place(gazetteer, place, mapbox_orientation)
+        if coordinates is not None:
+            return coordinates
+    geolocator = get_geolocator()
+    location = geolocator.geocode(place)
+    if location is None:
+        return None
+    if mapbox_orientation:
+        return [location.longitude, location.latitude]
+    else:
+        return [location.latitude, location.longitude]
+
+def normalize_place(place):
+    """
+    Cache key for a place string: lower case, single spaces, ", " between parts
+    :param place: string name of county (ex: "Albany,  NY")
+    :return: normalized string (ex: "albany, ny")
+    """
+    place = re.sub(r'\s*,\s*', ', ', str(place).strip())
+    return " ".join(place.split()).lower()
+
+
+def load_geo_cache(path):
+    """
+    :param path: folder holding the geocode cache
+    :return: dictionary normalized place -> {"coordinates": [lat, long] or None, "retry_after": ISO time or None}
+    """
+    cache_file = Path(path, GEO_CACHE_NAME)
+    if cache_file.exists():
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_geo_cache(cache, path):
+    """
+    Writes the geocode cache atomically
+    :param cache: dictionary from load_geo_cache()
+    :param path: folder holding the geocode cache
+    :return: None
+    """
+    cache_file = Path(path, GEO_CACHE_NAME)
+    tmp_file = cache_file.with_suffix(".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_file, cache_file)
+    return
+
+
+def orient(lat_long, mapbox_orientation=True):
+    """
+    :param lat_long: [lat, long] or None
+    :param mapbox_orientation: bool to return [long, lat]
+    :return: list in the requested orientation, or None
+    """
+    if lat_long is None:
         return None
+    return [lat_long[1], lat_long[0]] if mapbox_orientation else list(lat_long)
+
+
+def cached_geo(place, cache, mapbox_orientation=True, now=None):
+    """
+    geo() backed by the persistent cache; places that didn't resolve are only retried after MISS_RETRY_AFTER
+    :param place: string name of county to lookup
+    :param cache: dictionary from load_geo_cache() (updated in place)
+    :param mapbox_orientation: bool to flip longitude and latitude
+    :param now: current time (for testing)
+    :return: (coordinates as in geo(), bool if the geocoding service was called)
+    """
+    now = now or datetime.now()
+    key = normalize_place(place)
+    entry = cache.get(key)
+    if entry is not None:
+        if entry["coordinates"] is not None:
+            return orient(entry["coordinates"], mapbox_orientation), False
+        if entry["retry_after"] is not None and now < datetime.fromisoformat(entry["retry_after"]):
+            return None, False
+    try:
+        lat_long = geo(place, mapbox_orientation=False)
+    except GeocoderServiceError as e:  # timeout or outage, not a real miss; try again next run
+        print("Geocoding {} failed: {}".format(place, e))
+        return None, True
+    record_result(cache, place, lat_long, now)
+    return orient(lat_long, mapbox_orientation), True
+
+
+def record_result(cache, place, lat_long, now=None):
+    """
+    Stores a geocoding answer in the cache
+    :param cache: dictionary from load_geo_cache() (updated in place)
+    :param place: string name of county that was looked up
+    :param lat_long: [lat, long], or None if the service didn't find the place
+    :param now: current time (for testing)
+    :return: None
+    """
+    now = now or datetime.now()
+    cache[normalize_place(place)] = {
+        "coordinates": lat_long,
+        "retry_after": None if lat_long is not None else (now + MISS_RETRY_AFTER).isoformat(),
+    }
+    return
+
+
+def set_coordinates(d_frame, found):
+    """
+    Stores coordinates as float64 Longitude and Latitude columns (NaN, written as null to Feather, if unresolved)
+    Each distinct place is unpacked once
+    :param d_frame: pandas dataframe with the "Merged" place column
+    :param found: dictionary place -> [long, lat] or None
+    :return: d_frame=updated pandas dataframe
+    """
+    codes, places = pd.factorize(d_frame['Merged'])
+    coords = np.array([found.get(p) or [np.nan, np.nan] for p in places], dtype=np.float64).reshape(-1, 2)
+    has_place = codes >= 0
+    for i, col in enumerate([hp.LONGITUDE, hp.LATITUDE]):
+        values = np.full(len(d_frame), np.nan)
+        values[has_place] = coords[codes[has_place], i]
+        d_frame[col] = values
+    return d_frame
+
 
 def clean_counties(counties):
     """
@@ -45,29 +180,75 @@ def clean_counties(counties):
     #d_frame['County'] = d_frame['County'].apply(geo)
     return counties
 
-def find_coordinates(d_frame):
+def find_coordinates(d_frame, cache_path=None, save_every=50, gazetteer=None):
     """
     Driver function to find coordinates for locations in "Merged" column of pandas dataframe d_frame
-    Store coordinates [long, lat] in pandas dataframe d_frame at "Locations"
+    Each distinct "County, State" string is looked up once: in the offline gazetteer if given,
+    then in the geocode cache at cache_path, then with the geocoding service
+    Store coordinates in pandas dataframe d_frame at "Longitude" and "Latitude" (see set_coordinates())
     :param d_frame: pandas dataframe to pull County and State strings from, and save coordinates to
+    :param cache_path: folder holding the geocode cache (None to keep the cache in memory only)
+    :param save_every: write the cache after this many service calls so an interrupted run keeps its progress
+    :param gazetteer: dictionary from county_gazetteer.load_gazetteer(), or None
     :return: d_frame=updated pandas dataframe
     """
     d_frame['Merged'] = d_frame['County'] + ", " + d_frame['State']
-    d_frame['Locations'] = d_frame['Merged'].apply(geo)
-    return d_frame
+    cache = load_geo_cache(cache_path) if cache_path is not None else {}
+    places = d_frame['Merged'].dropna().unique()
+    found = {}
+    calls = 0
+    for place in places:
+        if gazetteer is not None:
+            found[place] = gz.geocode_place(gazetteer, place)
+            if found[place] is not None:
+                continue
+        found[place], called = cached_geo(place, cache)
+        calls += called
+        if called and cache_path is not None and calls % save_every == 0:
+            save_geo_cache(cache, cache_path)
+    if cache_path is not None:
+        save_geo_cache(cache, cache_path)
+    print("{} rows, {} distinct places, {} geocoding calls".format(len(d_frame), len(places), calls))
+    return set_coordinates(d_frame, found)
 
-def find_coordinates2(d_frame):
+def find_coordinates_batch(d_frame, cache_path, gazetteer=None, geocode=None, **batch_kwargs):
     """
-    (Not using)
-    Alternative geolocator API strategy to get around timeout
+    find_coordinates() for large queues: places missing from the gazetteer and cache are geocoded
+    concurrently under a rate limit, with retries, journaling progress to cache_path (see batch_geocoder.py)
     :param d_frame: pandas dataframe to pull County and State strings from, and save coordinates to
+    :param cache_path: folder holding the geocode cache and journal
+    :param gazetteer: dictionary from county_gazetteer.load_gazetteer(), or None
+    :param geocode: function place -> [lat, long] or None (defaults to batch_geocoder.make_geocoder())
+    :param batch_kwargs: keyword arguments for batch_geocoder.geocode_batch() (concurrency, rate, retries, ...)
     :return: d_frame=updated pandas dataframe
     """
-    geolocator = Nominatim(user_agent="sensus")
-    #geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1.0001)
     d_frame['Merged'] = d_frame['County'] + ", " + d_frame['State']
-    d_frame['Locations'] = d_frame['Merged'].apply(geolocator.geocode)
-    return d_frame
+    cache = load_geo_cache(cache_path)
+    found = {}
+    to_lookup = []
+    for place in d_frame['Merged'].dropna().unique():
+        if gazetteer is not None:
+            found[place] = gz.geocode_place(gazetteer, place)
+            if found[place] is not None:
+                continue
+        entry = cache.get(normalize_place(place))
+        if entry is not None and (entry["coordinates"] is not None or
+                                  datetime.now() < datetime.fromisoformat(entry["retry_after"])):
+            found[place] = orient(entry["coordinates"])
+        else:
+            to_lookup.append(place)
+    journal_path = Path(cache_path, "geocode_journal.jsonl")
+    results, failed = bg.run_batch(to_lookup, geocode, journal_path=journal_path, **batch_kwargs)
+    for place, lat_long in results.items():
+        record_result(cache, place, lat_long)
+        found[place] = orient(lat_long)
+    for place, error in failed.items():
+        print("Geocoding {} failed: {}".format(place, error))
+        found[place] = None
+    save_geo_cache(cache, cache_path)
+    if not failed:  # everything is in the cache now
+        journal_path.unlink(missing_ok=True)
+    return set_coordinates(d_frame, found)
 
 def geo_tester():
     """
@@ -83,18 +264,20 @@ def geo_tester():
 
 def main():
     path_to_data = "/Users/derekwacks/Documents/Interconnection/code/data/"
-    loc_path = path_to_data + "locs.csv"
-    loc_file = Path(loc_path)
-    if loc_file.exists() == False:
+    if Path(path_to_data, hp.LOCS_NAME).exists():
+        full_d_frame = hp.check_path_and_load_data(hp.LOCS_NAME, path_to_data)
+    elif Path(path_to_data, "locs.csv").exists():  # written before coordinates had their own columns
+        full_d_frame = hp.split_locations(hp.check_path_and_load_data("locs.csv", path_to_data, use_cache=False))
+        hp.save_feather(hp.LOCS_NAME, full_d_frame, path_to_data)
+    else:
         f_name = "NYISO_InterconnectionQueue_locations.csv"
-        d_frame = hp.load_csv(f_name, path_to_data)
+        d_frame = hp.check_path_and_load_data(f_name, path_to_data)
         d_frame['County'] = d_frame['County'].apply(clean_counties)  # Clean
         start_time_1 = datetime.now()
-        full_d_frame = find_coordinates(d_frame)
+        gazetteer = gz.load_gazetteer(gz.GAZETTEER_NAME, path_to_data)
+        full_d_frame = find_coordinates(d_frame, cache_path=path_to_data, gazetteer=gazetteer)
         print("Time elapsed:", datetime.now()-start_time_1)
-        hp.save_csv("locs.csv", full_d_frame, path_to_data)
-    else:  # locations csv exists
-        full_d_frame = hp.load_csv("locs.csv", path_to_data)
+        hp.save_feather(hp.LOCS_NAME, full_d_frame, path_to_data)
     print(full_d_frame)
     return
 
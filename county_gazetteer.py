@@ -0,0 +1,148 @@
+"""
+county_gazetteer.py
+Offline geocoder for "<County>, <State>" strings using a local county gazetteer file
+(U.S. Census Gazetteer county file, or any CSV with FIPS, name, state and centroid latitude/longitude)
+Names resolve through a dictionary of normalized keys; reverse lookups use a KD-tree of county centroids
+"""
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from scipy.spatial import cKDTree
+import normalization as nz
+
+GAZETTEER_NAME = "2023_Gaz_counties_national.txt"
+# Census Gazetteer headers -> our names; other files can use the right-hand names directly
+COLUMN_NAMES = {
+    "GEOID": "FIPS",
+    "NAME": "County",
+    "USPS": "State",
+    "INTPTLAT": "Latitude",
+    "INTPTLONG": "Longitude",
+}
+
+
+def read_gazetteer_file(f_name, path):
+    """
+    :param f_name: gazetteer file name (.txt is read as tab separated, anything else as CSV)
+    :param path: path to the gazetteer file
+    :return: pandas dataframe with FIPS, County, State, Latitude, Longitude columns
+    """
+    full_path = Path(path, f_name)
+    sep = "\t" if f_name.endswith(".txt") else ","
+    counties = pd.read_csv(full_path, sep=sep, dtype={"GEOID": str, "FIPS": str})
+    counties.columns = [c.strip() for c in counties.columns]  # Census files pad the last header
+    counties = counties.rename(columns=COLUMN_NAMES)
+    counties = counties[["FIPS", "County", "State", "Latitude", "Longitude"]]
+    return counties.dropna(subset=["Latitude", "Longitude"]).reset_index(drop=True)
+
+
+def to_unit_vectors(lat, lon):
+    """
+    Converts latitude/longitude in degrees to points on the unit sphere,
+    so straight-line nearest neighbours in the KD-tree are also great-circle nearest neighbours
+    :param lat: array of latitudes
+    :param lon: array of longitudes
+    :return: n x 3 numpy array
+    """
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def build_gazetteer(counties):
+    """
+    :param counties: pandas dataframe with FIPS, County, State, Latitude, Longitude columns
+    :return: gazetteer dictionary of column arrays, a name index and a KD-tree
+    """
+    keys = zip(nz.county_keys(counties["County"]), nz.state_keys(counties["State"]))
+    index = {}
+    for row, key in enumerate(keys):
+        index.setdefault(key, row)
+    lat = counties["Latitude"].to_numpy(dtype=float)
+    lon = counties["Longitude"].to_numpy(dtype=float)
+    return {
+        "fips": counties["FIPS"].to_numpy(dtype=object),
+        "county": counties["County"].to_numpy(dtype=object),
+        "state": counties["State"].to_numpy(dtype=object),
+        "lat": lat,
+        "lon": lon,
+        "index": index,
+        "tree": cKDTree(to_unit_vectors(lat, lon)),
+    }
+
+
+def load_gazetteer(f_name=GAZETTEER_NAME, path="."):
+    """
+    :param f_name: gazetteer file name
+    :param path: path to the gazetteer file
+    :return: gazetteer dictionary from build_gazetteer(), or None if the file is missing
+    """
+    if not Path(path, f_name).exists():
+        print("Gazetteer {} not found, using the online geocoder only".format(f_name))
+        return None
+    return build_gazetteer(read_gazetteer_file(f_name, path))
+
+
+def split_place(place):
+    """
+    :param place: "<County>, <State>" string
+    :return: (county, state) strings, state is None if there is no comma
+    """
+    if not isinstance(place, str):
+        return None, None
+    county, sep, state = place.rpartition(",")
+    if not sep:
+        return place, None
+    return county, state
+
+
+def find_row(gazetteer, county, state):
+    """
+    :param gazetteer: dictionary from build_gazetteer()
+    :param county: county name in any spelling handled by normalization.county_key()
+    :param state: state name or abbreviation
+    :return: row number in the gazetteer, or None
+    """
+    return gazetteer["index"].get((nz.county_key(county), nz.state_key(state)))
+
+
+def geocode_place(gazetteer, place, mapbox_orientation=True):
+    """
+    Offline version of coordinate_locator.geo()
+    :param gazetteer: dictionary from build_gazetteer()
+    :param place: "<County>, <State>" string
+    :param mapbox_orientation: bool to return [long, lat] instead of [lat, long]
+    :return: list [long, lat] or [lat, long] of the county centroid, or None
+    """
+    county, state = split_place(place)
+    if state is None:
+        return None
+    row = find_row(gazetteer, county, state)
+    if row is None:
+        return None
+    lat, lon = float(gazetteer["lat"][row]), float(gazetteer["lon"][row])
+    return [lon, lat] if mapbox_orientation else [lat, lon]
+
+
+def nearest_counties(gazetteer, lat, lon, k=1):
+    """
+    Reverse lookup: counties with the closest centroids to each point
+    :param gazetteer: dictionary from build_gazetteer()
+    :param lat: latitude or array of latitudes
+    :param lon: longitude or array of longitudes
+    :param k: number of counties to return per point
+    :return: pandas dataframe with the query point number, FIPS, County, State and distance in km
+    """
+    points = to_unit_vectors(np.atleast_1d(lat), np.atleast_1d(lon))
+    k = min(k, len(gazetteer["fips"]))  # the tree pads missing neighbours with an out-of-range row
+    chord, rows = gazetteer["tree"].query(points, k=k)
+    chord, rows = np.asarray(chord).reshape(len(points), -1), np.asarray(rows).reshape(len(points), -1)
+    distance_km = 2 * 6371.0 * np.arcsin(np.clip(chord / 2, 0, 1))
+    flat_rows = rows.ravel()
+    return pd.DataFrame({
+        "point": np.repeat(np.arange(len(points)), rows.shape[1]),
+        "FIPS": gazetteer["fips"][flat_rows],
+        "County": gazetteer["county"][flat_rows],
+        "State": gazetteer["state"][flat_rows],
+        "distance_km": distance_km.ravel(),
+    })
@@ -0,0 +1,155 @@
+"""
+county_matcher.py
+Fuzzy matching of free-text place names (ex: the "Entity" and "Government" columns of the Bryce database) to counties
+~ * ~ * ~ * ~ *
+index every county name by its character trigrams
+for a query, only counties sharing a trigram with it are scored (Dice similarity of trigram sets)
+so matching doesn't compare every record against every county
+"""
+import re
+import numpy as np
+import pandas as pd
+import geography as geo
+import normalization as nz
+
+# Words in government/entity names that say what kind of body it is, not where it is
+GENERIC_WORDS = {
+    "county", "counties", "parish", "borough", "township", "town", "city", "village", "of", "the", "and",
+    "board", "commission", "commissioners", "council", "supervisors", "planning", "zoning", "legislature",
+    "court", "fiscal", "appeals", "adjustment", "trustees", "selectmen", "state", "department", "dept",
+}
+WORD = re.compile(r'[a-z0-9]+')
+
+
+def match_text(name, drop_generic=False):
+    """
+    :param name: place name
+    :param drop_generic: bool to also drop words like "Township" or "Board" (see GENERIC_WORDS)
+    :return: lower case words joined by single spaces, without a trailing "County"/"Parish"/... suffix
+    """
+    if not isinstance(name, str):
+        return ""
+    text = " ".join(WORD.findall(nz.PUNCTUATION.sub('', name).lower()))
+    text = nz.COUNTY_SUFFIX.sub('', text)
+    if drop_generic:
+        text = " ".join(w for w in text.split() if w not in GENERIC_WORDS)
+    return text
+
+
+def trigrams(text):
+    """
+    :param text: output of match_text()
+    :return: set of character trigrams of each word, padded so short names still have some ("  a", " ab", ...)
+    """
+    grams = set()
+    for word in text.split():
+        padded = "  " + word + " "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def build_index(registry):
+    """
+    :param registry: dictionary from geography.load_registry()/build_registry()
+    :return: trigram index dictionary: trigram -> numpy array of county rows, and per-row ids, names, states and sizes
+    """
+    names = registry["names"].reset_index()
+    postings = {}
+    sizes = np.zeros(len(names), dtype=np.int32)
+    for row, county in enumerate(names["County"]):
+        grams = trigrams(match_text(county))
+        sizes[row] = len(grams)
+        for gram in grams:
+            postings.setdefault(gram, []).append(row)
+    state_codes, state_vocab = pd.factorize(nz.state_keys(names["State"]))
+    return {
+        "postings": {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()},
+        "sizes": sizes,
+        "ids": names[geo.ID_COLUMN].to_numpy(dtype=np.int32),
+        "counties": names["County"].to_numpy(dtype=object),
+        "state_codes": state_codes,
+        "state_vocab": pd.Index(state_vocab),
+    }
+
+
+def best_match(index, text, state=None):
+    """
+    :param index: dictionary from build_index()
+    :param text: place name to match (output of match_text())
+    :param state: state name or abbreviation to restrict candidates to, or None
+    :return: (row of the best county or -1, Dice score in [0, 1])
+    """
+    grams = trigrams(text)
+    hits = [index["postings"][g] for g in grams if g in index["postings"]]
+    if not hits:
+        return -1, 0.0
+    rows, shared = np.unique(np.concatenate(hits), return_counts=True)
+    if state is not None:
+        state_code = index["state_vocab"].get_indexer([nz.state_key(state)])[0]
+        in_state = index["state_codes"][rows] == state_code
+        rows, shared = rows[in_state], shared[in_state]
+        if len(rows) == 0:
+            return -1, 0.0
+    scores = 2.0 * shared / (len(grams) + index["sizes"][rows])
+    best = int(np.argmax(scores))
+    return int(rows[best]), float(scores[best])
+
+
+def match_records(index, queries, states=None, min_score=0.5):
+    """
+    Batch matching; each distinct (query, state) pair is scored once
+    :param index: dictionary from build_index()
+    :param queries: pandas Series of place names
+    :param states: pandas Series of states (same index as queries), or None
+    :param min_score: scores below this are reported as no match
+    :return: pandas dataframe (index of queries) with CountyID (-1 if no match), County_match and match_score
+    """
+    texts = nz.map_unique(queries, match_text, drop_generic=True).fillna("")
+    if states is None:
+        states = pd.Series(None, index=queries.index, dtype=object)
+    pairs = list(zip(texts, [s if isinstance(s, str) else None for s in states]))
+    found = {}
+    for text, state in dict.fromkeys(pairs):
+        found[(text, state)] = best_match(index, text, state) if text else (-1, 0.0)
+    rows = np.array([found[p][0] for p in pairs], dtype=np.int64)
+    scores = np.array([found[p][1] for p in pairs], dtype=float)
+    matched = (rows >= 0) & (scores >= min_score)
+    return pd.DataFrame({
+        geo.ID_COLUMN: np.where(matched, index["ids"][np.maximum(rows, 0)], -1).astype(np.int32),
+        "County_match": np.where(matched, index["counties"][np.maximum(rows, 0)], None),
+        "match_score": np.where(matched, scores, 0.0),
+    }, index=queries.index)
+
+
+def resolve_counties(data, registry, query_cols=("County", "Government", "Entity"), state_col="State",
+                     min_score=0.5):
+    """
+    Finds a county for every record: the best-scoring match over the query columns, within the record's state
+    An exact registry match on the first query column scores 1.0
+    :param data: pandas dataframe of records (ex: the Bryce database)
+    :param registry: dictionary from geography.load_registry()/build_registry()
+    :param query_cols: columns holding place names, most specific first
+    :param state_col: column holding the record's state
+    :param min_score: scores below this are reported as no match
+    :return: data with CountyID, County_match and match_score columns
+    """
+    index = build_index(registry)
+    states = data[state_col] if state_col in data.columns else None
+    best = pd.DataFrame({geo.ID_COLUMN: np.full(len(data), -1, dtype=np.int32), "County_match": None,
+                         "match_score": 0.0}, index=data.index)
+    for col in query_cols:
+        if col not in data.columns:
+            continue
+        candidate = match_records(index, data[col], states, min_score)
+        better = candidate["match_score"] > best["match_score"]
+        best.loc[better] = candidate.loc[better]
+    first = query_cols[0]
+    if first in data.columns and states is not None:
+        exact = geo.county_ids(registry, data[first], states)
+        is_exact = exact >= 0
+        best.loc[is_exact, geo.ID_COLUMN] = exact[is_exact]
+        best.loc[is_exact, "County_match"] = registry["names"]["County"].reindex(exact[is_exact]).to_numpy()
+        best.loc[is_exact, "match_score"] = 1.0
+    print("Matched {} of {} records to a county".format(int((best[geo.ID_COLUMN] >= 0).sum()), len(data)))
+    data = data.drop(columns=[c for c in best.columns if c in data.columns])
+    return pd.concat([data, best], axis=1)
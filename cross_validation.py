@@ -0,0 +1,125 @@
+"""
+cross_validation.py
+Stratified (and repeated) k-fold cross-validation of the models in models.py (built by model_helpers.ESTIMATORS)
+~ * ~ * ~ * ~ *
+the feature matrix and labels are built once; joblib memory-maps them read-only into the worker processes
+every (model, repeat, fold) task runs in parallel and reports accuracy, log-loss, AUC and its fit/predict time
+results come back as a tidy data frame, one row per model and fold
+"""
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+from sklearn.model_selection import RepeatedKFold, RepeatedStratifiedKFold
+import model_helpers as mdlhp
+import run_models as rm
+
+TARGET = "indicator"
+
+
+# Model name -> function of the full feature matrix returning an unfitted model (shared with models.py)
+MODELS = mdlhp.ESTIMATORS
+
+
+def make_folds(y, n_splits=5, n_repeats=1, stratified=True, random_state=0):
+    """
+    :param y: numpy array of labels
+    :param n_splits: folds per repeat
+    :param n_repeats: number of times to repeat k-fold with a different shuffle
+    :param stratified: bool to keep the withdrawn/in-service ratio in every fold
+    :param random_state: seed for the shuffles
+    :return: list of (repeat, fold, train rows, test rows)
+    """
+    splitter = RepeatedStratifiedKFold if stratified else RepeatedKFold
+    splits = splitter(n_splits=n_splits, n_repeats=n_repeats, random_state=random_state).split(np.zeros(len(y)), y)
+    return [(i // n_splits, i % n_splits, train, test) for i, (train, test) in enumerate(splits)]
+
+
+def score_fold(name, x, y, repeat, fold, train, test):
+    """
+    Fits one model on one fold's training rows and scores it on the test rows
+    :param name: key of MODELS
+    :param x: feature matrix (read-only, shared between workers)
+    :param y: labels (read-only, shared between workers)
+    :param repeat: repeat number
+    :param fold: fold number
+    :param train: training rows
+    :param test: test rows
+    :return: result dictionary for the fold
+    """
+    result = {"model": name, "repeat": repeat, "fold": fold, "n_train": len(train), "n_test": len(test),
+              "accuracy": np.nan, "log_loss": np.nan, "auc": np.nan, "fit_seconds": np.nan,
+              "predict_seconds": np.nan, "error": None}
+    start = time.perf_counter()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            model = MODELS[name](x).fit(x[train], y[train])
+            result["fit_seconds"] = time.perf_counter() - start
+            start = time.perf_counter()
+            prob = model.predict_proba(x[test])[:, 1]
+            result["predict_seconds"] = time.perf_counter() - start
+    except Exception as e:  # ex: a statsmodels fit that doesn't converge; keep the other folds
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        return result
+    y_test = y[test]
+    result["accuracy"] = accuracy_score(y_test, (prob >= 0.5).astype(int))
+    result["log_loss"] = log_loss(y_test, np.clip(prob, 1e-15, 1 - 1e-15), labels=[0, 1])
+    if len(np.unique(y_test)) == 2:
+        result["auc"] = roc_auc_score(y_test, prob)
+    return result
+
+
+def cross_validate(merged_data, models=None, target=TARGET, n_splits=5, n_repeats=1, stratified=True,
+                   n_jobs=-1, random_state=0):
+    """
+    :param merged_data: pandas df from run_models.format_data_for_exp() (feature columns and the indicator)
+    :param models: list of MODELS keys (defaults to all)
+    :param target: label column
+    :param n_splits: folds per repeat
+    :param n_repeats: number of times to repeat k-fold with a different shuffle
+    :param stratified: bool for stratified folds
+    :param n_jobs: joblib worker processes (-1 for one per CPU)
+    :param random_state: seed for the fold shuffles
+    :return: pandas df with one row per model, repeat and fold
+    """
+    models = models or list(MODELS)
+    x = np.ascontiguousarray(merged_data.drop(columns=[target]).to_numpy(dtype=np.float64))
+    y = merged_data[target].to_numpy(dtype=np.int64)
+    folds = make_folds(y, n_splits, n_repeats, stratified, random_state)
+    start = time.perf_counter()
+    results = Parallel(n_jobs=n_jobs, max_nbytes="1M", mmap_mode="r")(
+        delayed(score_fold)(name, x, y, repeat, fold, train, test)
+        for name in models for repeat, fold, train, test in folds)
+    print("{} models x {} folds in {:.1f}s".format(len(models), len(folds), time.perf_counter() - start))
+    return pd.DataFrame(results)
+
+
+def summarize(results):
+    """
+    :param results: pandas df from cross_validate()
+    :return: pandas df of the mean and standard deviation of each metric per model
+    """
+    metrics = ["accuracy", "log_loss", "auc", "fit_seconds"]
+    summary = results.groupby("model")[metrics].agg(["mean", "std"])
+    summary["failed_folds"] = results.groupby("model")["error"].count()
+    return summary.sort_values(("log_loss", "mean"))
+
+
+def main(n_splits=5, n_repeats=3):
+    path = "/Users/derekwacks/Documents/Interconnection/code/data/training"
+    f_names = ["NYISO_withdrawn.csv", "NYISO_inservice.csv",
+               "ISONE_withdrawn.csv", "ISONE_inservice.csv",
+               "MISO_withdrawn.csv", "MISO_inservice.csv",
+               "PJM_withdrawn.csv", "PJM_inservice.csv",]
+    cols_to_include = ['NaturalAmenityTier']
+    merged_data = rm.format_data_for_exp(f_names, path, cols_to_include)
+    results = cross_validate(merged_data, n_splits=n_splits, n_repeats=n_repeats)
+    print(summarize(results))
+    return results
+
+
+if __name__ == "__main__":
+    main()
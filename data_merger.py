@@ -6,6 +6,105 @@ import pandas as pd
 import helpers as hp
 import numpy as np
 from pathlib import Path
+import geography as geo
+import queue_delta as qd
+
+
+AMENITIES_NAME = "Natural_Amenities_by_County_cleaned.csv"
+JOIN_KEYS = ["County", "State"]
+MATRIX_VERSION = 2  # bump when the join or matrix assembly changes, so stored matrices are rebuilt (2: CountyID join)
+
+
+def load_amenities(path):
+    """
+    :param path: path to queue data (the amenity table lives one folder up)
+    :return: pandas dataframe of the cleaned natural amenity data
+    """
+    path_to_data = Path(path, "../")
+    return hp.check_path_and_load_data(AMENITIES_NAME, path_to_data)
+
+
+def build_amenity_index(amenities, keys=JOIN_KEYS):
+    """
+    Integer-codes the County and State columns of the amenity table once so queue frames can be joined by array lookups
+    If the table has CountyIDs (see geography.py) a CountyID -> row table is built too
+    :param amenities: pandas dataframe of amenity data
+    :param keys: [county column, state column]
+    :return: dictionary with the county and state vocabularies, dense code -> row lookup tables and the amenity columns
+    """
+    county_vocab = pd.Index(amenities[keys[0]].unique())
+    state_vocab = pd.Index(amenities[keys[1]].unique())
+    county_codes = county_vocab.get_indexer(amenities[keys[0]])
+    state_codes = state_vocab.get_indexer(amenities[keys[1]])
+    combined = county_codes * len(state_vocab) + state_codes
+    if pd.Series(combined).duplicated().any():
+        print("WARNING: amenity table has repeated {} pairs, joining on the first".format(keys))
+    lookup = np.full(len(county_vocab) * len(state_vocab), -1, dtype=np.int64)
+    rows = np.arange(len(amenities))
+    lookup[combined[::-1]] = rows[::-1]  # reversed so the first row of a repeated pair wins
+    id_lookup = None
+    if geo.ID_COLUMN in amenities.columns:
+        ids = amenities[geo.ID_COLUMN].to_numpy()
+        known = ids >= 0
+        id_lookup = np.full(int(ids.max(initial=0)) + 1, -1, dtype=np.int64)
+        id_lookup[ids[known][::-1]] = rows[known][::-1]
+    return {
+        "keys": list(keys),
+        "county_vocab": county_vocab,
+        "state_vocab": state_vocab,
+        "lookup": lookup,
+        "id_lookup": id_lookup,
+        "data": amenities.drop(columns=list(keys) + [geo.ID_COLUMN], errors="ignore").reset_index(drop=True),
+    }
+
+
+def lookup_rows(amenity_index, queue):
+    """
+    :param amenity_index: dictionary from build_amenity_index()
+    :param queue: pandas dataframe with the key columns
+    :return: numpy array of amenity row numbers (-1 where the county isn't in the amenity table)
+    Rows with a CountyID are matched on it; the rest fall back to the County/State strings
+    """
+    county_key, state_key = amenity_index["keys"]
+    county_codes = amenity_index["county_vocab"].get_indexer(queue[county_key])
+    state_codes = amenity_index["state_vocab"].get_indexer(queue[state_key])
+    found = (county_codes >= 0) & (state_codes >= 0)
+    combined = np.where(found, county_codes * len(amenity_index["state_vocab"]) + state_codes, 0)
+    rows = np.where(found, amenity_index["lookup"][combined], -1)
+    id_lookup = amenity_index["id_lookup"]
+    if id_lookup is not None and geo.ID_COLUMN in queue.columns:
+        ids = queue[geo.ID_COLUMN].fillna(-1).to_numpy(dtype=np.int64)
+        has_id = (ids >= 0) & (ids < len(id_lookup))
+        id_rows = id_lookup[np.where(has_id, ids, 0)]
+        rows = np.where(has_id & (id_rows >= 0), id_rows, rows)
+    return rows
+
+
+def join_amenities(queue_frames, amenity_index):
+    """
+    Left-joins amenity data onto every queue frame (same rows and columns as DataFrame.merge(how="left") on County and
+    State, including _x/_y suffixes on shared column names), matching on CountyID where available
+    Each frame is joined on its own against the integer-coded index, so its columns and dtypes are kept as they are
+    :param queue_frames: dictionary name -> pandas dataframe of queue data
+    :param amenity_index: dictionary from build_amenity_index()
+    :return: dictionary name -> merged pandas dataframe
+    """
+    return {n: join_frame(queue, amenity_index) for n, queue in queue_frames.items()}
+
+
+def join_frame(queue, amenity_index):
+    """
+    :param queue: pandas dataframe of queue data
+    :param amenity_index: dictionary from build_amenity_index()
+    :return: queue with the amenity columns of its county added (NaN where it isn't in the amenity table)
+    """
+    rows = lookup_rows(amenity_index, queue)
+    amenity_data = amenity_index["data"].reindex(rows).reset_index(drop=True)
+    queue = queue.reset_index(drop=True)
+    shared = set(queue.columns) & set(amenity_data.columns)
+    queue = queue.rename(columns={c: c + "_x" for c in shared})
+    amenity_data = amenity_data.rename(columns={c: c + "_y" for c in shared})
+    return pd.concat([queue, amenity_data], axis=1)
 
 
 def add_amenity_data_and_save(f_name, path):
@@ -16,37 +115,73 @@ def add_amenity_data_and_save(f_name, path):
     :param path: path to queue data, and where to save new .CSV to
     :return: name of new merged CSV file
     """
-    f_data = hp.check_path_and_load_data(f_name, path)
-    merged_df = f_data.copy()
-    path_to_data = Path(path, "../")
+    add_amenity_data_driver([f_name], path)
+    return "merged_" + f_name
+
+
+def add_amenity_data_driver(f_names, path, save=True):
+    """
+    Adds amenity indices to each row in each csv included in f_names
+    The amenity table is loaded and indexed once and each file is joined against that index
+    :param f_names: list of CSV file names (ex: "NYISO_withdrawn.csv", "NYISO_inservice.csv", etc.)
+    :param path: path to csv files
+    :param save: bool to write each merged frame to merged_<file name>.csv
+    :return: list of new file names  (ex: "merged_NYISO_withdrawn.csv", "merged_NYISO_inservice.csv", etc.)
+    """
+    merged_frames = merge_amenities(f_names, path, save=save)
+    return ["merged_" + n for n in merged_frames]
 
-    amenities_f = "Natural_Amenities_by_County_cleaned.csv"
-    amenities_data = hp.check_path_and_load_data(amenities_f, path_to_data)
-    merged_df = merged_df.merge(amenities_data, how="left", on=["County", "State"])
 
+def merge_amenities(f_names, path, save=False):
+    """
+    :param f_names: list of CSV file names
+    :param path: path to csv files
+    :param save: bool to write each merged frame to merged_<file name>.csv
+    :return: dictionary file name -> merged pandas dataframe
+    """
+    queue_frames = {n: hp.check_path_and_load_data(n, path) for n in f_names}
+    amenity_index = build_amenity_index(load_amenities(path))
+    merged_frames = join_amenities(queue_frames, amenity_index)
     # TODO: add other data here!
     #opposed_projects_f = "opposed_projects_filled.csv"
     #opposed_projects = hp.check_path_and_load_data(opposed_projects_f, path_to_data)
     #merged_df = merged_df.merge(opposed_projects, how="left", on=["County", "State"])
+    if save:
+        for n, merged_df in merged_frames.items():
+            hp.save_csv("merged_" + n, merged_df, path)
+    return merged_frames
 
-    save_as = "merged_" + f_name
-    hp.save_csv(save_as, merged_df, path)
-    return
 
-
-def add_amenity_data_driver(f_names, path):
+def merge_delta(f_names, delta, path, amenity_index=None, save=True):
     """
-    Adds amenity indices to each row in each csv included in f_names
-    :param f_names: list of CSV file names (ex: "NYISO_withdrawn.csv", "NYISO_inservice.csv", etc.)
+    Incremental version of merge_amenities() for the status files of one ISO
+    Only the inserted and updated projects of the delta are joined to the amenity data; they replace the projects'
+    old rows in the existing merged_<file name>.csv files, and withdrawn projects are dropped (see queue_delta.py)
+    Falls back to merge_amenities() when a merged file doesn't exist yet
+    :param f_names: list of the ISO's CSV file names (ex: "NYISO_active.csv", "NYISO_withdrawn.csv")
+    :param delta: pandas dataframe from queue_delta.diff_snapshot()
     :param path: path to csv files
-    :return: list of new file names  (ex: "merged_NYISO_withdrawn.csv", "merged_NYISO_inservice.csv", etc.)
+    :param amenity_index: dictionary from build_amenity_index(), or None to load the amenity table
+    :param save: bool to write each merged frame to merged_<file name>.csv
+    :return: dictionary file name -> merged pandas dataframe
     """
-    save_names = []
+    if not all(Path(path, "merged_" + n).exists() for n in f_names):
+        return merge_amenities(f_names, path, save=save)
+    amenity_index = amenity_index or build_amenity_index(load_amenities(path))
+    previous = []
     for n in f_names:
-        save_name = "merged_" + n
-        add_amenity_data_and_save(n, path)
-        save_names.append(save_name)
-    return save_names
+        data = hp.check_path_and_load_data("merged_" + n, path)
+        data = data.drop(columns=[c for c in data.columns if c.startswith("Unnamed")])
+        previous.append(data.assign(Status=qd.status_from_name(n)))
+    merged = qd.apply_delta(pd.concat(previous, ignore_index=True), join_frame(delta, amenity_index))
+    merged_frames = {}
+    for n in f_names:
+        rows = merged["Status"] == qd.status_from_name(n)
+        merged_frames[n] = merged[rows].drop(columns=["Status"]).reset_index(drop=True)
+    if save:
+        for n, merged_df in merged_frames.items():
+            hp.save_csv("merged_" + n, merged_df, path)
+    return merged_frames
 
 
 def add_indicators(saved_names):
@@ -61,6 +196,68 @@ def add_indicators(saved_names):
     return all_data
 
 
+def select_matrix_rows(data, indicator, cols_to_include):
+    """
+    :param data: merged pandas dataframe of one queue file
+    :param indicator: 1 == in service, 0 == withdrawn
+    :param cols_to_include: columns to keep
+    :return: pandas dataframe of cols_to_include and indicator for rows with an amenity tier
+    """
+    data = data[cols_to_include].copy()
+    data = data[data['NaturalAmenityTier'].notnull()]  # remove Nan values
+    if 'Opposed' in cols_to_include:
+        data['Opposed'] = data['Opposed'].fillna(0)
+    data['indicator'] = indicator  # 1 == in service, 0 == withdrawn
+    return data
+
+
+def create_matrix_from_frames(frames_indic_tuples, cols_to_include):
+    """
+    In-memory version of create_matrix()
+    :param frames_indic_tuples: list of (merged pandas dataframe, indicator) tuples
+    :param cols_to_include: columns to keep
+    :return: pandas dataframe with in-service indicator (0 or 1) and amenity tier
+    """
+    parts = [select_matrix_rows(data, indicator, cols_to_include)
+             for data, indicator in frames_indic_tuples if not data.empty]
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts)  # one concatenation instead of one per file
+
+
+def build_matrix(queue_frames, amenities, cols_to_include):
+    """
+    In-memory pipeline: amenity join, indicators and matrix assembly without touching the filesystem
+    :param queue_frames: dictionary file name -> pandas dataframe of queue data (names decide the indicator,
+    ex: "NYISO_withdrawn.csv")
+    :param amenities: pandas dataframe of cleaned amenity data
+    :param cols_to_include: columns to keep
+    :return: (pandas dataframe matrix, dictionary file name -> merged pandas dataframe)
+    """
+    merged_frames = join_amenities(queue_frames, build_amenity_index(amenities))
+    names_indic_tuples = add_indicators(list(merged_frames.keys()))
+    matrix = create_matrix_from_frames([(merged_frames[n], indicator) for n, indicator in names_indic_tuples],
+                                       cols_to_include)
+    return matrix, merged_frames
+
+
+def build_matrix_from_files(f_names, path, cols_to_include, spill=False):
+    """
+    Loads queue files and the amenity table once and runs build_matrix()
+    :param f_names: list of CSV file names (ex: "NYISO_withdrawn.csv")
+    :param path: path to csv files
+    :param cols_to_include: columns to keep
+    :param spill: bool to also write merged_<file name>.csv for each file
+    :return: pandas dataframe matrix
+    """
+    queue_frames = {n: hp.check_path_and_load_data(n, path) for n in f_names}
+    matrix, merged_frames = build_matrix(queue_frames, load_amenities(path), cols_to_include)
+    if spill:
+        for n, merged_df in merged_frames.items():
+            hp.save_csv("merged_" + n, merged_df, path)
+    return matrix
+
+
 def create_matrix(f_names_indic_tuples, path, cols_to_include):
     """
     Assemble a data frame with in-service (successfully operating) and withdrawn projects and amenity tiers
@@ -68,17 +265,7 @@ def create_matrix(f_names_indic_tuples, path, cols_to_include):
     :param path: path to files
     :return: pandas dataframe with in-service indicator (0 or 1) and amenity tier
     """
-    merged = pd.DataFrame()
-    for tup in f_names_indic_tuples:
-        name = tup[0]
-        indicator = tup[1]
-        data = hp.check_path_and_load_data(name, path)
-        if not data.empty:
-            data = data[cols_to_include].copy()
-            data = data[data['NaturalAmenityTier'].notnull()]  # remove Nan values
-            if 'Opposed' in cols_to_include:
-                data['Opposed'] = data['Opposed'].fillna(0)
-            data['indicator'] = indicator  # 1 == in service, 0 == withdrawn
-            merged = pd.concat([merged, data])
-    return merged
+    frames_indic_tuples = [(hp.check_path_and_load_data(name, path), indicator)
+                           for name, indicator in f_names_indic_tuples]
+    return create_matrix_from_frames(frames_indic_tuples, cols_to_include)
 
@@ -0,0 +1,145 @@
+"""
+feature_store.py
+Stores the model matrix from data_merger.py as one downcast .npy file per column, memory-mapped read-only on load
+Entries are keyed by a hash of the input files' contents, the selected columns and the builder's version,
+so changed inputs (or a changed join) get a new entry
+"""
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+STORE_FOLDER = "feature_store"
+MANIFEST_NAME = "manifest.json"
+INT_TYPES = [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.int64]
+STORE_FORMAT = 1  # bump when the layout of an entry changes
+
+
+def inputs_hash(f_names, path, cols_to_include, extra_files=(), version=None):
+    """
+    :param f_names: queue CSV file names the matrix is built from
+    :param path: path to the queue CSV files
+    :param cols_to_include: columns selected for the matrix
+    :param extra_files: other input file paths (ex: the amenity table)
+    :param version: version of the code building the matrix (ex: data_merger.MATRIX_VERSION)
+    :return: hex sha256 of the store format, version, column list and file contents
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([STORE_FORMAT, version, list(cols_to_include)]).encode("utf-8"))
+    for full_path in [Path(path, n) for n in f_names] + [Path(p) for p in extra_files]:
+        digest.update(full_path.name.encode("utf-8"))
+        if not full_path.exists():
+            digest.update(b"<missing>")
+            continue
+        with open(full_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def downcast(values):
+    """
+    Smallest dtype that holds values exactly: uint8/int8/... for whole numbers, float32 if lossless, else float64
+    :param values: numpy array
+    :return: numpy array with the smaller dtype
+    """
+    if values.dtype == bool:
+        return values.astype(np.uint8)
+    if values.dtype.kind not in "iuf":
+        return values
+    if values.size and np.isfinite(values).all() and np.equal(np.mod(values, 1), 0).all():
+        low, high = values.min(), values.max()
+        for int_type in INT_TYPES:
+            info = np.iinfo(int_type)
+            if info.min <= low and high <= info.max:
+                return values.astype(int_type)
+    as_float32 = values.astype(np.float32)
+    if np.array_equal(as_float32.astype(values.dtype), values, equal_nan=True):
+        return as_float32
+    return values
+
+
+def entry_dir(key, store_dir):
+    return Path(store_dir, key)
+
+
+def save_features(matrix, key, store_dir):
+    """
+    :param matrix: pandas dataframe of numeric features (ex: NaturalAmenityTier, Opposed, indicator)
+    :param key: hash from inputs_hash()
+    :param store_dir: feature store folder
+    :return: None
+    """
+    final_dir = entry_dir(key, store_dir)
+    tmp_dir = final_dir.with_name(key + ".{}.tmp".format(os.getpid()))
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {"columns": [], "rows": len(matrix)}
+    for i, col in enumerate(matrix.columns):
+        values = downcast(matrix[col].to_numpy())
+        if values.dtype == object:
+            print("WARNING: skipping non-numeric column", col)
+            continue
+        np.save(Path(tmp_dir, "{}.npy".format(i)), values)
+        manifest["columns"].append({"name": col, "file": "{}.npy".format(i), "dtype": str(values.dtype),
+                                    "source_dtype": str(matrix[col].dtype)})
+    with open(Path(tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    if final_dir.exists():  # another worker saved the same entry first
+        shutil.rmtree(tmp_dir)
+    else:
+        os.replace(tmp_dir, final_dir)
+    return
+
+
+def load_features(key, store_dir):
+    """
+    :param key: hash from inputs_hash()
+    :param store_dir: feature store folder
+    :return: dictionary column name -> read-only memory-mapped numpy array (in matrix column order), or None on a miss
+    """
+    manifest_path = Path(entry_dir(key, store_dir), MANIFEST_NAME)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return {c["name"]: np.load(Path(entry_dir(key, store_dir), c["file"]), mmap_mode="r")
+            for c in manifest["columns"]}
+
+
+def features_to_frame(features):
+    """
+    :param features: dictionary from load_features()
+    :return: pandas dataframe of the features
+    """
+    return pd.DataFrame(features, copy=False)  # one block per column, backed by the memory maps
+
+
+def load_or_build(f_names, path, cols_to_include, builder, extra_files=(), store_dir=None, version=None,
+                  rebuild=False):
+    """
+    Returns the stored matrix for these inputs, building and storing it on a miss
+    :param f_names: queue CSV file names the matrix is built from
+    :param path: path to the queue CSV files
+    :param cols_to_include: columns selected for the matrix
+    :param builder: function with no arguments returning the matrix as a pandas dataframe
+    :param extra_files: other input file paths (ex: the amenity table)
+    :param store_dir: feature store folder (defaults to <path>/feature_store)
+    :param version: version of the code building the matrix, part of the key
+    :param rebuild: bool to run builder even if the matrix is stored (ex: for its side effects)
+    :return: pandas dataframe of the features
+    """
+    store_dir = store_dir or Path(path, STORE_FOLDER)
+    key = inputs_hash(f_names, path, cols_to_include, extra_files, version)
+    features = None if rebuild else load_features(key, store_dir)
+    if features is None:
+        matrix = builder()
+        if matrix.empty:
+            return matrix
+        save_features(matrix, key, store_dir)
+        features = load_features(key, store_dir)
+    else:
+        print("Loaded features from", entry_dir(key, store_dir))
+    return features_to_frame(features)
@@ -0,0 +1,235 @@
+"""
+frame_cache.py
+On-disk columnar (Feather) cache for data frames loaded by helpers.py
+Entries are keyed by source path, modification time, size and sheet, so editing a source file invalidates its entry
+"""
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+CACHE_DIR = Path(os.getenv("SENSUS_CACHE_DIR", Path(__file__).resolve().parent / ".frame_cache"))
+MAX_CACHE_BYTES = int(os.getenv("SENSUS_CACHE_MAX_BYTES", 2 * 1024 ** 3))  # 2 GB
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "manifest.lock"
+
+
+def make_key(full_path, sheet_name, variant=""):
+    """
+    Creates the cache key for a source file
+    :param full_path: path to the source .csv/.xlsx file
+    :param sheet_name: sheet the frame was read from
+    :param variant: extra string describing how the frame was read (ex: selected columns)
+    :return: key=hex digest identifying this version of the file, or None if the file is missing
+    """
+    full_path = Path(full_path).resolve()
+    try:
+        stat = full_path.stat()
+    except OSError:
+        return None
+    raw = "|".join([str(full_path), str(stat.st_mtime_ns), str(stat.st_size), str(sheet_name), str(variant)])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def manifest_lock(cache_dir=CACHE_DIR):
+    """
+    Holds an exclusive lock on the cache folder while the manifest is read, changed and saved,
+    so parallel ingestion workers don't drop each other's entries
+    :param cache_dir: folder holding cached frames
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    with open(Path(cache_dir, LOCK_NAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_manifest(cache_dir=CACHE_DIR):
+    """
+    :param cache_dir: folder holding cached frames
+    :return: dictionary key -> {"source", "bytes"}
+    """
+    manifest_path = Path(cache_dir, MANIFEST_NAME)
+    if manifest_path.exists():
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print("WARNING: frame cache manifest is unreadable, starting a new one")
+    return {}
+
+
+def save_manifest(manifest, cache_dir=CACHE_DIR):
+    """
+    Writes the manifest atomically so an interrupted run can't corrupt it (call inside manifest_lock())
+    :param manifest: dictionary key -> entry info
+    :param cache_dir: folder holding cached frames
+    :return: None
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(cache_dir, MANIFEST_NAME)
+    tmp_path = manifest_path.with_suffix(".{}.tmp".format(os.getpid()))  # unique per process (parallel ingestion)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return
+
+
+def _entry_path(key, cache_dir):
+    return Path(cache_dir, key + ".feather")
+
+
+def read_cached(key, cache_dir=CACHE_DIR):
+    """
+    :param key: cache key from make_key()
+    :param cache_dir: folder holding cached frames
+    :return: d_frame=cached pandas data frame, or None on a miss
+    """
+    if key is None or not _entry_path(key, cache_dir).exists():
+        return None
+    entry_path = _entry_path(key, cache_dir)
+    try:
+        d_frame = pd.read_feather(entry_path)
+    except Exception as e:  # corrupt or unreadable entry, treat it as a miss
+        print("WARNING: could not read cached frame {}: {}".format(entry_path, e))
+        return None
+    # Arrow hands back missing strings as None, pandas readers use NaN
+    obj_cols = d_frame.select_dtypes("object").columns
+    d_frame[obj_cols] = d_frame[obj_cols].where(d_frame[obj_cols].notna(), np.nan)
+    try:
+        os.utime(entry_path)  # the file's mtime is its last use for LRU eviction; no manifest write on a hit
+    except OSError:  # evicted meanwhile by another process
+        pass
+    return d_frame
+
+
+def write_cached(key, d_frame, source, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Stores d_frame in the cache and evicts the least recently used entries beyond max_bytes
+    Frames that Feather can't represent (non-string column names, mixed-type object columns) are skipped
+    :param key: cache key from make_key()
+    :param d_frame: pandas data frame to store
+    :param source: path of the source file (used by invalidate())
+    :param cache_dir: folder holding cached frames
+    :param max_bytes: size limit of the cache folder
+    :return: bool if the frame was cached
+    """
+    if key is None or d_frame.empty:
+        return False
+    if not all(isinstance(c, str) for c in d_frame.columns):
+        return False
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    entry_path = _entry_path(key, cache_dir)
+    tmp_path = entry_path.with_suffix(".{}.tmp".format(os.getpid()))
+    try:
+        d_frame.reset_index(drop=True).to_feather(tmp_path)
+    except Exception as e:  # pyarrow missing or a column pyarrow can't type
+        print("WARNING: not caching {}: {}".format(source, e))
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return False
+    with manifest_lock(cache_dir):
+        os.replace(tmp_path, entry_path)
+        manifest = load_manifest(cache_dir)
+        manifest[key] = {
+            "source": str(Path(source).resolve()),
+            "bytes": entry_path.stat().st_size,
+        }
+        evict(manifest, cache_dir, max_bytes)
+        save_manifest(manifest, cache_dir)
+    return True
+
+
+def evict(manifest, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Removes least recently used entries (oldest file mtime) until the cache fits in max_bytes
+    Call inside manifest_lock()
+    :param manifest: dictionary key -> entry info (updated in place)
+    :param cache_dir: folder holding cached frames
+    :param max_bytes: size limit of the cache folder
+    :return: list of evicted keys
+    """
+    evicted = []
+    total = sum(entry["bytes"] for entry in manifest.values())
+    for key in sorted(manifest, key=lambda k: _last_used(k, cache_dir)):
+        if total <= max_bytes:
+            break
+        total -= manifest[key]["bytes"]
+        _remove_entry(key, manifest, cache_dir)
+        evicted.append(key)
+    return evicted
+
+
+def _last_used(key, cache_dir):
+    try:
+        return _entry_path(key, cache_dir).stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+def _remove_entry(key, manifest, cache_dir):
+    entry_path = _entry_path(key, cache_dir)
+    if entry_path.exists():
+        entry_path.unlink()
+    manifest.pop(key, None)
+
+
+def invalidate(source=None, cache_dir=CACHE_DIR):
+    """
+    Explicitly drops cached frames
+    :param source: path of a source file to drop entries for, or None to clear the whole cache
+    :param cache_dir: folder holding cached frames
+    :return: number of entries removed
+    """
+    with manifest_lock(cache_dir):
+        manifest = load_manifest(cache_dir)
+        if source is None:
+            keys = list(manifest.keys())
+        else:
+            source = str(Path(source).resolve())
+            keys = [k for k, entry in manifest.items() if entry["source"] == source]
+        for key in keys:
+            _remove_entry(key, manifest, cache_dir)
+        if source is None:  # also drop files left by a run that crashed before recording them
+            for orphan in Path(cache_dir).glob("*.feather"):
+                orphan.unlink()
+        save_manifest(manifest, cache_dir)
+    return len(keys)
+
+
+def cached_load(full_path, sheet_name, loader, variant="", cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Returns the cached frame for full_path if it is still current, otherwise calls loader() and caches the result
+    :param full_path: path to the source file
+    :param sheet_name: sheet the frame is read from
+    :param loader: function with no arguments that parses the source file into a data frame
+    :param variant: extra string describing how the frame was read (ex: selected columns)
+    :param cache_dir: folder holding cached frames
+    :param max_bytes: size limit of the cache folder
+    :return: d_frame=pandas data frame
+    """
+    key = make_key(full_path, sheet_name, variant)
+    d_frame = read_cached(key, cache_dir)
+    if d_frame is not None:
+        print("Loaded from cache:", full_path)
+        return d_frame
+    d_frame = loader()
+    write_cached(key, d_frame, full_path, cache_dir, max_bytes)
+    return d_frame
+
+
+def main():
+    removed = invalidate()
+    print("Removed {} cached frames from {}".format(removed, CACHE_DIR))
+    return
+
+
+if __name__ == "__main__":
+    main()
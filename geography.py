@@ -0,0 +1,127 @@
+"""
+geography.py
+Canonical county registry
+Maps every spelling of a county/state pair (see normalization.county_key and state_key) to one integer CountyID,
+the county FIPS code when a gazetteer file is available, so parsers and data_merger.py join on integers instead of strings
+"""
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import county_gazetteer as gz
+import normalization as nz
+
+ID_COLUMN = "CountyID"
+REGISTRY_NAME = "county_registry.csv"
+
+
+def pair_keys(counties, states):
+    """
+    :param counties: pandas Series of county names in any spelling
+    :param states: pandas Series of state names or abbreviations
+    :return: pandas Series of "<county key>|<state key>" strings (NaN if either part is missing)
+    """
+    county_keys = nz.county_keys(counties.reset_index(drop=True))
+    state_keys = nz.state_keys(states.reset_index(drop=True))
+    keys = county_keys.astype(object) + "|" + state_keys.astype(object)
+    keys.index = counties.index
+    return keys
+
+
+def build_registry(counties, aliases=None):
+    """
+    :param counties: pandas dataframe with County and State columns, and a FIPS column if known
+    :param aliases: optional dictionary (county, state) spelling -> (county, state) canonical name for names
+    normalization can't reconcile (ex: {("Dona Ana", "NM"): ("Doña Ana", "NM")})
+    :return: registry dictionary with the key -> CountyID lookup and CountyID -> canonical name table
+    """
+    counties = counties.reset_index(drop=True)
+    keys = pair_keys(counties["County"], counties["State"])
+    if "FIPS" in counties.columns:
+        ids = pd.to_numeric(counties["FIPS"], errors="coerce")
+    else:  # no FIPS codes: intern the keys in sorted order so IDs are stable between runs
+        ids = keys.map({k: i + 1 for i, k in enumerate(sorted(keys.dropna().unique()))})
+    table = pd.DataFrame({"key": keys, ID_COLUMN: ids, "County": counties["County"], "State": counties["State"]})
+    table = table.dropna(subset=["key", ID_COLUMN]).drop_duplicates("key")
+    table[ID_COLUMN] = table[ID_COLUMN].astype(np.int32)
+    lookup = dict(zip(table["key"], table[ID_COLUMN]))
+    for (county, state), (canon_county, canon_state) in (aliases or {}).items():
+        canon = lookup.get(nz.county_key(canon_county) + "|" + nz.state_key(canon_state))
+        if canon is not None:
+            lookup[nz.county_key(county) + "|" + nz.state_key(state)] = canon
+    names = table.drop_duplicates(ID_COLUMN).set_index(ID_COLUMN)[["County", "State"]]
+    return {"lookup": lookup, "names": names}
+
+
+def save_registry(registry, path):
+    """
+    :param registry: dictionary from build_registry()
+    :param path: folder to write county_registry.csv to
+    :return: None
+    """
+    table = pd.DataFrame({"key": list(registry["lookup"].keys()), ID_COLUMN: list(registry["lookup"].values())})
+    table = table.merge(registry["names"].reset_index(), how="left", on=ID_COLUMN)
+    table.to_csv(Path(path, REGISTRY_NAME), index=False)
+    return
+
+
+def load_registry(path, gazetteer_name=gz.GAZETTEER_NAME, fallback_name="Natural_Amenities_by_County_cleaned.csv"):
+    """
+    Loads county_registry.csv from path, building it first from the county gazetteer (FIPS IDs)
+    or, without a gazetteer, from the cleaned amenity table (interned IDs)
+    :param path: data folder
+    :param gazetteer_name: county gazetteer file name
+    :param fallback_name: file with County and State columns to use when there is no gazetteer
+    :return: registry dictionary, or None if no source file exists
+    """
+    registry_path = Path(path, REGISTRY_NAME)
+    if registry_path.exists():
+        table = pd.read_csv(registry_path, dtype={"key": str})
+        lookup = dict(zip(table["key"], table[ID_COLUMN].astype(np.int32)))
+        names = table.drop_duplicates(ID_COLUMN).set_index(ID_COLUMN)[["County", "State"]]
+        return {"lookup": lookup, "names": names}
+    if Path(path, gazetteer_name).exists():
+        counties = gz.read_gazetteer_file(gazetteer_name, path)
+    elif Path(path, fallback_name).exists():
+        counties = pd.read_csv(Path(path, fallback_name))[["County", "State"]]
+    else:
+        print("No gazetteer or amenity table in {}, county IDs unavailable".format(path))
+        return None
+    registry = build_registry(counties)
+    save_registry(registry, path)
+    return registry
+
+
+def county_ids(registry, counties, states):
+    """
+    :param registry: dictionary from build_registry()/load_registry()
+    :param counties: pandas Series of county names in any spelling
+    :param states: pandas Series of state names or abbreviations
+    :return: numpy int32 array of CountyIDs, -1 where the county isn't known
+    """
+    keys = pair_keys(counties, states)
+    codes, uniques = pd.factorize(keys)
+    unique_ids = np.array([registry["lookup"].get(k, -1) for k in uniques], dtype=np.int32)
+    ids = np.full(len(keys), -1, dtype=np.int32)
+    found = codes >= 0
+    ids[found] = unique_ids[codes[found]]
+    return ids
+
+
+def add_county_ids(d_frame, registry, county_col="County", state_col="State"):
+    """
+    Adds the CountyID column to d_frame
+    :param d_frame: pandas dataframe with county and state columns
+    :param registry: dictionary from build_registry()/load_registry(), or None to leave d_frame as is
+    :param county_col: name of the county column
+    :param state_col: name of the state column
+    :return: d_frame=updated pandas dataframe
+    """
+    if registry is None or d_frame.empty:
+        return d_frame
+    d_frame = d_frame.copy()
+    d_frame[ID_COLUMN] = county_ids(registry, d_frame[county_col], d_frame[state_col])
+    unmatched = d_frame.loc[d_frame[ID_COLUMN] < 0, [county_col, state_col]].drop_duplicates()
+    if not unmatched.empty:
+        print("WARNING: {} county/state pairs not in the registry, ex: {}".format(
+            len(unmatched), unmatched.head(5).values.tolist()))
+    return d_frame
@@ -6,11 +6,23 @@ parse .csv of data
 for each line of data, create geojson formatted file
 save file
 """
+import math
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import json
 import helpers as hp
 
+# GeoJSON property name -> (data frame column, convert to str like create_feature())
+PROPERTY_COLUMNS = {
+    "title": ("Project Name", False),
+    "County": ("County", False),
+    "State": ("State", False),
+    "DeveloperName": ("Developer Name", True),
+    "PointsofInterconnection": ("Points of Interconnection", True),
+}
+OPTIONAL_COLUMNS = ["Status", "ISO"]  # written as properties when the data has them (ex: for per-ISO tilesets)
+
 
 def create_feature(row):
     """
@@ -18,9 +30,12 @@ def create_feature(row):
     :param row: dictionary of project data
     :return: ret=formatted feature json
     """
-    coordinates = row['Locations'][1:-1]
-    coors = coordinates.split(", ")
-    coors = [float(i) for i in coors]
+    if hp.LONGITUDE in row:
+        coors = [float(row[hp.LONGITUDE]), float(row[hp.LATITUDE])]
+    else:  # legacy "[long, lat]" string
+        coordinates = row['Locations'][1:-1]
+        coors = coordinates.split(", ")
+        coors = [float(i) for i in coors]
     ret = {
         "type": "Feature",
         "properties": {
@@ -63,13 +78,120 @@ def create_full_geojson(full_d_frame):
     print("Done creating interconnection.geojson")
 
 
-def main():
+def coordinate_arrays(d_frame):
+    """
+    :param d_frame: pandas dataframe with Longitude and Latitude columns (or a legacy Locations column)
+    :return: (numpy float64 array of longitudes, numpy float64 array of latitudes), NaN where there is no location
+    """
+    if hp.LONGITUDE not in d_frame.columns:
+        d_frame = hp.split_locations(d_frame[['Locations']].copy())
+    return (d_frame[hp.LONGITUDE].to_numpy(dtype=np.float64, na_value=np.nan),
+            d_frame[hp.LATITUDE].to_numpy(dtype=np.float64, na_value=np.nan))
+
+
+def json_value(value, as_str):
+    """
+    :param value: cell value
+    :param as_str: bool to convert to str (as create_feature() does)
+    :return: value that json can write (NaN -> null)
+    """
+    if as_str:
+        return str(value)
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def project_ids(d_frame):
+    """
+    :param d_frame: pandas dataframe of projects
+    :return: numpy array of stable project IDs "<ISO>-<queue Position>" (None where the row has no Position)
+    """
+    if "Position" not in d_frame.columns:
+        return np.full(len(d_frame), None, dtype=object)
+    isos = d_frame["ISO"].fillna("Unknown") if "ISO" in d_frame.columns else pd.Series("Unknown", index=d_frame.index)
+    positions = d_frame["Position"].to_numpy(dtype=object)
+    ids = np.full(len(d_frame), None, dtype=object)
+    for i, (iso, position) in enumerate(zip(isos.to_numpy(dtype=object), positions)):
+        if position is None or (isinstance(position, float) and math.isnan(position)):
+            continue
+        if isinstance(position, (float, np.floating)) and float(position).is_integer():  # 1234.0 read back from CSV
+            position = int(position)
+        ids[i] = "{}-{}".format(iso, str(position).strip())
+    return ids
+
+
+def iter_features(d_frame, precision=6):
+    """
+    Generates GeoJSON features from the columns of d_frame without building per-row dictionaries in the frame
+    Rows without a location are skipped; each feature gets an "id" property from project_ids()
+    :param d_frame: pandas dataframe with Longitude/Latitude columns and the columns in PROPERTY_COLUMNS
+    :param precision: decimal places kept in coordinates
+    :return: generator of feature dictionaries
+    """
+    lon, lat = coordinate_arrays(d_frame)
+    lon, lat = np.round(lon, precision), np.round(lat, precision)
+    columns = {prop: (d_frame[col].to_numpy(dtype=object) if col in d_frame.columns
+                      else np.full(len(d_frame), None, dtype=object), as_str)
+               for prop, (col, as_str) in PROPERTY_COLUMNS.items()}
+    columns.update({col: (d_frame[col].to_numpy(dtype=object), False) for col in OPTIONAL_COLUMNS
+                    if col in d_frame.columns})
+    ids = project_ids(d_frame)
+    for i in range(len(d_frame)):
+        if np.isnan(lon[i]) or np.isnan(lat[i]):
+            continue
+        properties = {prop: json_value(values[i], as_str) for prop, (values, as_str) in columns.items()}
+        properties["description"] = "stuff!"
+        properties["id"] = ids[i]
+        yield {
+            "type": "Feature",
+            "properties": properties,
+            "geometry": {"coordinates": [float(lon[i]), float(lat[i])], "type": "Point"},
+        }
+
+
+def write_geojson(frames, out_path, ndjson=False, precision=6):
+    """
+    Streams features to disk as compact GeoJSON (or newline-delimited GeoJSON, one feature per line)
+    :param frames: pandas dataframe, or iterable of dataframes (ex: pd.read_csv(..., chunksize=...))
+    :param out_path: path of the file to write
+    :param ndjson: bool to write newline-delimited GeoJSON instead of a FeatureCollection
+    :param precision: decimal places kept in coordinates
+    :return: number of features written
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    count = 0
+    with open(out_path, 'w', encoding='utf-8') as f:
+        if not ndjson:
+            f.write('{"type":"FeatureCollection","features":[\n')
+        for d_frame in frames:
+            for feature in iter_features(d_frame, precision):
+                if count and not ndjson:
+                    f.write(",\n")
+                f.write(json.dumps(feature, ensure_ascii=False, separators=(",", ":")))
+                if ndjson:
+                    f.write("\n")
+                count += 1
+        if not ndjson:
+            f.write("\n]}\n")
+    print("Wrote {} features to {}".format(count, out_path))
+    return count
+
+
+def main(ndjson=False, precision=6, chunksize=50000):
     path_to_data = "/Users/derekwacks/Documents/Interconnection/code/data/"
-    f_name = "locs.csv"
-    full_d_frame = hp.load_csv(f_name, path_to_data)
-    print(full_d_frame)
-    full_d_frame = add_geojsons(full_d_frame)
-    create_full_geojson(full_d_frame)
+    if Path(path_to_data, hp.LOCS_NAME).exists():
+        columns = ([hp.LONGITUDE, hp.LATITUDE, "Position"] + [col for col, _ in PROPERTY_COLUMNS.values()]
+                   + OPTIONAL_COLUMNS)
+        d_frame = pd.read_feather(Path(path_to_data, hp.LOCS_NAME))
+        chunks = [d_frame[[c for c in columns if c in d_frame.columns]]]
+    else:  # legacy locs.csv with "[long, lat]" strings
+        chunks = pd.read_csv(Path(path_to_data, "locs.csv"), chunksize=chunksize)
+    out_name = "interconnection.geojsonl" if ndjson else "interconnection.geojson"
+    write_geojson(chunks, Path(path_to_data, out_name), ndjson=ndjson, precision=precision)
     return
 
 if __name__ == "__main__":
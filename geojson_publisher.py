@@ -2,109 +2,380 @@
 geojson_publisher.py
 Uploads a geojson file to Mapbox via APIs
 """
+import hashlib
 import os
+import tempfile
+import threading
+import time
 import pandas as pd
 from pathlib import Path
 import json
 import helpers as hp
 import requests
-from dotenv import load_dotenv, set_key
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv, dotenv_values
 from os.path import join, dirname
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from datetime import datetime, timedelta
 from requests.exceptions import RequestException
 
 dotenv_path = join(dirname(__file__), "frontend/use-mapbox-gl-js-with-react/",'.env')
 load_dotenv(dotenv_path)
+PUBLISH_MANIFEST_NAME = "publish_manifest.json"
+DELTA_STATE_NAME = "published_features.json"
+MB = 1024 * 1024
+MAPBOX_API_URL = os.getenv("MAPBOX_API_URL", "https://api.mapbox.com")  # ex: http://localhost:8080 for a stand-in
+TILESET_NAME = "interconnectionGEOJSON"
+CRED_TTL = timedelta(minutes=30)
+CRED_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+ENV_KEYS = {"bucket": "BUCKET", "key": "KEY", "accessKeyId": "ACCESSKEYID", "secretAccessKey": "SECRETACCESSKEY",
+            "sessionToken": "SESSIONTOKEN"}
+TIMEOUT = (5, 60)  # seconds to connect, seconds to wait for a response
+_session = None
+_s3_clients = {}
+_provider = None
+_s3_lock = threading.Lock()  # boto3's default session isn't thread-safe
+_manifest_lock = threading.RLock()  # copy_to_s3() runs in several threads (see tileset_publisher.py)
+
+
+def get_session(retries=3, backoff=0.5):
+    """
+    :param retries: retries after a connection error (any request) or a read error or 429/5xx response (GET only)
+    :param backoff: seconds to wait before the first retry, doubled for each later retry
+    :return: requests Session shared by every Mapbox API call in this process (pooled connections)
+    """
+    global _session
+    if _session is None:
+        # a POST that reached the server may have started an upload or issued a staging key, so it is only
+        # retried when the connection failed before it was sent
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                      status_forcelist=[429, 500, 502, 503, 504], allowed_methods=frozenset(["GET"]),
+                      raise_on_status=False)
+        _session = requests.Session()
+        _session.mount("https://", HTTPAdapter(pool_maxsize=16, max_retries=retry))
+        _session.mount("http://", HTTPAdapter(pool_maxsize=16, max_retries=retry))
+    return _session
+
+
+def fetch_aws_creds(base_url=None):
+    """
+    Asks Mapbox for temporary S3 credentials (and a new staging key)
+    :param base_url: API host (defaults to MAPBOX_API_URL)
+    :return: dictionary creds=AWS credentials
+    Raises requests.exceptions.RequestException if the request failed
+    """
+    url = (base_url or MAPBOX_API_URL) + "/uploads/v1/derekjw99/credentials"
+    params = {
+        'access_token': os.getenv("MAPBOX_SECRET_ACCESS_TOKEN")  # REACT_APP_MAPBOX_ACCESS_TOKEN
+    }
+    r = get_session().post(url=url, params=params, timeout=TIMEOUT)
+    r.raise_for_status()
+    return r.json()
+
+
+class CredentialProvider:
+    """
+    Keeps the Mapbox-issued S3 credentials in memory and renews them once they are ttl old
+    Concurrent callers renewing expired credentials share one renewal (single flight); a forced renewal always
+    fetches its own credentials, since each one comes with its own staging key
+    """
+    def __init__(self, fetch=fetch_aws_creds, ttl=CRED_TTL, persist=False):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.persist = persist  # write renewed credentials to .env
+        self.creds = None
+        self.fetched = None
+        self.lock = threading.Lock()
+
+    def load_env(self):
+        """
+        Starts from the credentials saved in .env, if they have a timestamp (parsed once)
+        :return: None
+        """
+        set_time = os.getenv("CRED_TIMESTAMP")  # time that AWS credentials were recently updated in .env
+        if set_time:
+            self.creds = {name: os.getenv(env_key) for name, env_key in ENV_KEYS.items()}
+            self.fetched = datetime.strptime(set_time, CRED_TIME_FORMAT)
+
+    def fresh(self, now=None):
+        """
+        :param now: current time (for testing)
+        :return: bool if the credentials in memory are younger than ttl
+        """
+        return self.creds is not None and (now or datetime.now()) - self.fetched <= self.ttl
+
+    def get(self, renew=False):
+        """
+        :param renew: bool to ask for new credentials (and staging key) even if the current ones are fresh
+        :return: dictionary creds=AWS credentials
+        """
+        if renew:
+            print("Renewing credentials")
+            creds = self.fetch()
+            with self.lock:
+                self.store(creds)
+            return creds
+        if self.fresh():
+            return self.creds
+        with self.lock:
+            if self.fresh():  # renewed by another caller meanwhile
+                return self.creds
+            print("Renewing credentials")
+            self.store(self.fetch())
+            return self.creds
+
+    def store(self, creds):
+        """
+        Keeps new credentials as the current ones (caller holds the lock)
+        :param creds: dictionary of AWS credentials
+        :return: None
+        """
+        self.creds = creds
+        self.fetched = datetime.now()
+        if self.persist:
+            update_keys(self.creds, self.fetched)
+
+
+def get_provider(overwrite_keys=False):
+    """
+    :param overwrite_keys: bool to save renewed credentials to .env
+    :return: CredentialProvider shared by this process
+    """
+    global _provider
+    if _provider is None:
+        _provider = CredentialProvider()
+        _provider.load_env()
+    _provider.persist = _provider.persist or overwrite_keys
+    return _provider
 
 def renew_creds():
     """
-    check in .env to see if credentials are more than 30 minutes old
+    check if the credentials are more than 30 minutes old
     :return: bool if creds are expired
     """
-    set_time = os.getenv("CRED_TIMESTAMP")  # time that AWS credentials were recently updated in .env
-    expiration = timedelta(minutes=30)
-    if datetime.now() - datetime.strptime(set_time, "%Y-%m-%d %H:%M:%S.%f") > expiration:
-        print("Credentials are expired")
-        return True
-    else:
+    if get_provider().fresh():
         print("Credentials are fresh")
         return False
+    print("Credentials are expired")
+    return True
 
-def update_keys(creds):
+def update_keys(creds, set_time=None):
     """
-    Overwrite the AWS credentials in .env with new creds
+    Overwrite the AWS credentials in .env with new creds, writing the file once
     :param creds: dictionary of creds
+    :param set_time: time the creds were issued (defaults to now)
     :return: None
     """
     print("Overwriting keys")
-    set_key(dotenv_path, "BUCKET", creds["bucket"])
-    set_key(dotenv_path, "KEY", creds["key"])
-    set_key(dotenv_path, "ACCESSKEYID", creds["accessKeyId"])
-    set_key(dotenv_path, "SECRETACCESSKEY", creds["secretAccessKey"])
-    set_key(dotenv_path, "SESSIONTOKEN", creds["sessionToken"])
-    set_key(dotenv_path, "CRED_TIMESTAMP",str(datetime.now()))
+    values = dotenv_values(dotenv_path) if Path(dotenv_path).exists() else {}
+    values.update({env_key: creds[name] for name, env_key in ENV_KEYS.items()})
+    values["CRED_TIMESTAMP"] = (set_time or datetime.now()).strftime(CRED_TIME_FORMAT)
+    tmp_path = dotenv_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for env_key, value in values.items():
+            f.write("{}='{}'\n".format(env_key, str(value or "").replace("'", "\\'")))
+    os.replace(tmp_path, dotenv_path)
     print("Keys updated in .env")
     return
 
-def get_aws_creds(overwrite_keys=False):
+def get_aws_creds(overwrite_keys=False, renew=False):
     """
-    Gets temporary AWS creds from Mapbox endpoint
-    If our stored credentials are too old and overwrite_keys is True, overwrite them
-    overwrite_keys: bool flag to indicate if the .env file is overwritten
+    Gets temporary AWS creds from Mapbox endpoint, reusing the ones in memory until they are too old
+    overwrite_keys: bool flag to indicate if the .env file is overwritten with renewed creds
+    renew: bool to get new creds (and a new staging key) even if the current ones are fresh
     :return: dictionary creds=AWS credentials
     """
     creds = {}
-    if not renew_creds():  # Check if credentials are outdated
-        creds["bucket"] = os.getenv("BUCKET")
-        creds["key"] = os.getenv("KEY")
-        creds["accessKeyId"] = os.getenv("ACCESSKEYID")
-        creds["secretAccessKey"] = os.getenv("SECRETACCESSKEY")
-        creds["sessionToken"] = os.getenv("SESSIONTOKEN")
-    else:
-        url = "https://api.mapbox.com/uploads/v1/derekjw99/credentials"
-        params = {
-            'access_token': os.getenv("MAPBOX_SECRET_ACCESS_TOKEN")  # REACT_APP_MAPBOX_ACCESS_TOKEN
-        }
-        try:
-            r = requests.post(url=url, params=params)
-            print(r)
-            creds = r.json()
-            if overwrite_keys:
-                update_keys(creds)
-        except RequestException as e:
-            print("Failed to get new keys:", e)
+    try:
+        creds = get_provider(overwrite_keys).get(renew)
+    except RequestException as e:
+        print("Failed to get new keys:", e)
     return creds
 
-def copy_to_s3(path, file_name, creds):
+def file_sha256(full_path):
+    """
+    :param full_path: path to the file
+    :return: hex sha256 of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        for block in iter(lambda: f.read(MB), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_publish_manifest(path):
+    """
+    :param path: folder holding publish_manifest.json
+    :return: dictionary file name -> {"sha256", "bucket", "key", "size", "uploaded", "published"} of the last upload
+    ("published" is the id of the accepted upload job, or None while the staged file hasn't been published)
+    """
+    manifest_file = Path(path, PUBLISH_MANIFEST_NAME)
+    if manifest_file.exists():
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_publish_manifest(manifest, path):
+    """
+    :param manifest: dictionary from load_publish_manifest()
+    :param path: folder holding publish_manifest.json
+    :return: None
+    """
+    manifest_file = Path(path, PUBLISH_MANIFEST_NAME)
+    with _manifest_lock:
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=path, suffix=".tmp", delete=False) as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(f.name, manifest_file)
+    return
+
+
+def update_publish_manifest(path, file_name, **fields):
+    """
+    Sets fields of one file's entry, re-reading the manifest so entries written by other threads are kept
+    :param path: folder holding publish_manifest.json
+    :param file_name: geojson file the entry is for
+    :param fields: entry values to set
+    :return: None
+    """
+    with _manifest_lock:
+        manifest = load_publish_manifest(path)
+        manifest[file_name] = dict(manifest.get(file_name, {}), **fields)
+        save_publish_manifest(manifest, path)
+    return
+
+
+def is_published(path, file_name):
+    """
+    :param path: folder holding publish_manifest.json
+    :param file_name: geojson file
+    :return: bool if the file's last staged upload was accepted by the uploads API
+    """
+    return bool(load_publish_manifest(path).get(file_name, {}).get("published"))
+
+
+def mark_published(path, file_name, upload_id):
+    """
+    Records that the staged file was accepted by the uploads API
+    :param path: folder holding publish_manifest.json
+    :param file_name: geojson file
+    :param upload_id: "id" from the publish() response
+    :return: None
+    """
+    update_publish_manifest(path, file_name, published=upload_id)
+    return
+
+
+def make_transfer_config(threshold_mb=8, chunk_mb=8, max_concurrency=8):
+    """
+    :param threshold_mb: files at least this big go up as multipart uploads
+    :param chunk_mb: size of each part
+    :param max_concurrency: parts uploaded in parallel
+    :return: boto3 TransferConfig
+    """
+    return TransferConfig(multipart_threshold=threshold_mb * MB, multipart_chunksize=chunk_mb * MB,
+                          max_concurrency=max_concurrency, use_threads=True)
+
+
+class UploadProgress:
+    """
+    boto3 upload callback printing the percentage done and throughput (called from the transfer threads)
+    """
+    def __init__(self, file_name, size, report_every=0.1):
+        self.file_name = file_name
+        self.size = size
+        self.report_every = report_every  # fraction of the file between printouts
+        self.sent = 0
+        self.next_report = report_every
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, bytes_sent):
+        with self.lock:
+            self.sent += bytes_sent
+            done = self.sent / self.size if self.size else 1.0
+            if done >= self.next_report or self.sent == self.size:
+                print("{}: {:.0%} ({:.1f} MB/s)".format(self.file_name, done, self.throughput()))
+                while self.next_report <= done:
+                    self.next_report += self.report_every
+
+    def throughput(self):
+        """
+        :return: MB per second since the upload started
+        """
+        elapsed = time.perf_counter() - self.start
+        return self.sent / MB / elapsed if elapsed > 0 else 0.0
+
+
+def make_s3_client(creds, endpoint_url=None):
+    """
+    :param creds: AWS credentials from Mapbox
+    :param endpoint_url: S3 endpoint to use instead of AWS (ex: a local stand-in for testing), or None
+    :return: boto3 S3 client, reused while the credentials are the same
+    """
+    cache_key = (creds["accessKeyId"], creds["sessionToken"], endpoint_url)
+    with _s3_lock:
+        client = _s3_clients.get(cache_key)
+        if client is None:
+            print("Configuring client")
+            client = boto3.client(
+                's3', region_name="us-east-1", endpoint_url=endpoint_url,
+                aws_access_key_id=creds["accessKeyId"], aws_secret_access_key=creds["secretAccessKey"],
+                aws_session_token=creds["sessionToken"],
+                config=Config(retries={"max_attempts": 5, "mode": "standard"}, max_pool_connections=16))
+            _s3_clients.clear()  # clients for older credentials won't be used again
+            _s3_clients[cache_key] = client
+    return client
+
+
+def copy_to_s3(path, file_name, creds, s3_client=None, transfer_config=None, force=False):
     """
     Simialar to running "aws s3 cp /path/to/file s3://{bucket}/{key} --region us-east-1"
     Copies a local geojson file to s3 to stage it for a Mapbox tileset upload
+    Skips the upload if the same contents were already staged at the same bucket and key (see publish_manifest.json)
+    The entry is marked unpublished until mark_published() is called for it
     :param path: path to the geojson file
     :param file_name: name of the geojson file
     :param creds: AWS credentials from Mapbox
-    :return: None
+    :param s3_client: boto3 S3 client (defaults to make_s3_client(creds))
+    :param transfer_config: boto3 TransferConfig (defaults to make_transfer_config())
+    :param force: bool to upload even if the manifest says the file is already staged
+    :return: bool if the file was uploaded
     """
     path_to_geo = join(path, file_name)
     bucket_name = creds["bucket"]
     key = creds["key"]
-    access_Key_Id = creds["accessKeyId"]
-    secret_Access_Key = creds["secretAccessKey"]
-    aws_session_token = creds["sessionToken"]
-    print("Configuring client")
-    s3_client = boto3.client('s3', region_name="us-east-1", aws_access_key_id=access_Key_Id, aws_secret_access_key=secret_Access_Key, aws_session_token=aws_session_token)
+    sha256 = file_sha256(path_to_geo)
+    last = load_publish_manifest(path).get(file_name, {})
+    if not force and (last.get("sha256"), last.get("bucket"), last.get("key")) == (sha256, bucket_name, key):
+        print("{} unchanged since {}, skipping upload".format(file_name, last["uploaded"]))
+        return False
+    s3_client = s3_client or make_s3_client(creds)
+    size = os.path.getsize(path_to_geo)
+    progress = UploadProgress(file_name, size)
     print("Uploading file...")
-    s3_client.upload_file(Filename=path_to_geo, Bucket=bucket_name, Key=key)
-    print("Uploaded")
-    return
+    s3_client.upload_file(Filename=path_to_geo, Bucket=bucket_name, Key=key,
+                          Config=transfer_config or make_transfer_config(), Callback=progress,
+                          ExtraArgs={"Metadata": {"sha256": sha256}})
+    print("Uploaded {:.1f} MB at {:.1f} MB/s".format(size / MB, progress.throughput()))
+    update_publish_manifest(path, file_name, sha256=sha256, bucket=bucket_name, key=key, size=size,
+                            uploaded=str(datetime.now()), published=None)
+    return True
 
-def publish(creds):
+def publish(creds, tileset_name=TILESET_NAME, name="Updated_Interconnection", base_url=None):
     """
     Uploads a staged geojson file from S3
     :param creds: AWS credentials from Mapbox
-    :return: ret_data=requests.post() response
+    :param tileset_name: tileset to replace with the staged file
+    :param name: name of the upload
+    :param base_url: uploads API host (defaults to MAPBOX_API_URL)
+    :return: ret_data=requests.post() response, or None if the upload wasn't accepted
     """
-    url = "https://api.mapbox.com/uploads/v1/derekjw99"
+    url = (base_url or MAPBOX_API_URL) + "/uploads/v1/derekjw99"
     bucket_name = creds["bucket"]
     key_name = creds["key"]
     params = {
@@ -113,27 +384,246 @@ def publish(creds):
     ret_data = None
     payload = {
         "url": "https://{bucket}.s3.amazonaws.com/{key}".format(bucket=bucket_name, key=key_name),
-        "tileset": "{username}.{tileset_name}".format(username="derekjw99", tileset_name="interconnectionGEOJSON"),
-        "name": "Updated_Interconnection"
+        "tileset": "{username}.{tileset_name}".format(username="derekjw99", tileset_name=tileset_name),
+        "name": name
     }
     header = {
         "Content-Type": "application/json"
     }
     try:
-        r = requests.post(url=url, headers=header, params=params, data=json.dumps(payload))
+        r = get_session().post(url=url, headers=header, params=params, data=json.dumps(payload), timeout=TIMEOUT)
+        r.raise_for_status()
         ret_data = r.json()
     except RequestException as e:
         print("POST failed:", e)
     return ret_data
 
-def main():
+def check_upload(upload_id, base_url=None):
+    """
+    :param upload_id: "id" from the publish() response
+    :param base_url: uploads API host (defaults to MAPBOX_API_URL)
+    :return: upload status dictionary ("complete", "error", "progress", ...)
+    Raises requests.exceptions.RequestException if the request failed
+    """
+    url = "{}/uploads/v1/derekjw99/{}".format(base_url or MAPBOX_API_URL, upload_id)
+    params = {
+        'access_token': os.getenv("MAPBOX_SECRET_ACCESS_TOKEN"),
+    }
+    r = get_session().get(url=url, params=params, timeout=TIMEOUT)
+    r.raise_for_status()
+    return r.json()
+
+def wait_for_upload(upload_id, base_url=None, poll_interval=2.0, max_interval=30.0, timeout=1800.0):
+    """
+    :param upload_id: "id" from the publish() response
+    :param base_url: uploads API host (defaults to MAPBOX_API_URL)
+    :param poll_interval: seconds before the first status check, doubled after each check up to max_interval
+    :param max_interval: longest wait between checks
+    :param timeout: seconds to wait before giving up
+    :return: last upload status dictionary (with "error" set if the job failed or timed out)
+    """
+    start = time.monotonic()
+    wait = poll_interval
+    while True:
+        time.sleep(wait)
+        try:
+            status = check_upload(upload_id, base_url)
+        except RequestException as e:  # the session already retried; keep polling until the timeout
+            status = {"complete": False, "error": None, "poll_error": str(e)}
+        if status.get("complete") or status.get("error"):
+            return status
+        if time.monotonic() - start + wait > timeout:
+            return dict(status, error="timed out after {:.0f}s".format(time.monotonic() - start))
+        wait = min(wait * 2, max_interval)
+
+def read_features(full_path):
+    """
+    :param full_path: path to a GeoJSON FeatureCollection or newline-delimited GeoJSON file
+    :return: list of feature dictionaries
+    """
+    with open(full_path, 'r', encoding='utf-8') as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "{" and not str(full_path).endswith((".geojsonl", ".ndjson")):
+            return json.load(f)["features"]
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def feature_id(feature):
+    """
+    :param feature: GeoJSON feature dictionary
+    :return: project ID: the "id" property if set (ISO and queue Position, see geojson_creator.project_ids()),
+    else a hash of the project's name, county, state and POI
+    """
+    props = feature["properties"]
+    if props.get("id") is not None:
+        return str(props["id"])
+    identity = [props.get(k) for k in ["title", "County", "State", "PointsofInterconnection"]]
+    return hashlib.sha1(json.dumps(identity).encode("utf-8")).hexdigest()[:16]
+
+
+def feature_hash(feature):
+    """
+    :param feature: GeoJSON feature dictionary
+    :return: hash of the feature's properties and geometry
+    """
+    body = json.dumps([feature["properties"], feature["geometry"]], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def feature_ids(features):
+    """
+    :param features: list of GeoJSON feature dictionaries
+    :return: list of project IDs, a repeated ID numbered by its order in the file ("<id>#2", ...) so no project is lost
+    """
+    ids, seen = [], {}
+    for f in features:
+        fid = feature_id(f)
+        seen[fid] = seen.get(fid, 0) + 1
+        ids.append(fid if seen[fid] == 1 else "{}#{}".format(fid, seen[fid]))
+    repeated = sum(n - 1 for n in seen.values())
+    if repeated:
+        print("WARNING: {} features repeat another feature's project ID".format(repeated))
+    return ids
+
+
+def feature_hashes(features):
+    """
+    :param features: list of GeoJSON feature dictionaries
+    :return: dictionary project ID (see feature_ids()) -> feature hash
+    """
+    return {fid: feature_hash(f) for fid, f in zip(feature_ids(features), features)}
+
+
+def diff_features(features, published):
+    """
+    :param features: list of GeoJSON feature dictionaries about to be published
+    :param published: dictionary project ID -> feature hash of a previous publish
+    :return: changeset dictionary: "add" and "update" feature lists, "delete" list of project IDs
+    """
+    changeset = {"add": [], "update": [], "delete": []}
+    seen = set()
+    for fid, feature in zip(feature_ids(features), features):
+        seen.add(fid)
+        if fid not in published:
+            changeset["add"].append(feature)
+        elif published[fid] != feature_hash(feature):
+            changeset["update"].append(feature)
+    changeset["delete"] = sorted(fid for fid in published if fid not in seen)
+    return changeset
+
+
+def load_delta_state(path):
+    """
+    :param path: folder holding published_features.json
+    :return: dictionary with the base and last published feature hashes and the base publish time, or None
+    """
+    state_file = Path(path, DELTA_STATE_NAME)
+    if not state_file.exists():
+        return None
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_delta_state(state, path):
+    """
+    :param state: dictionary from load_delta_state()
+    :param path: folder holding published_features.json
+    :return: None
+    """
+    state_file = Path(path, DELTA_STATE_NAME)
+    tmp_file = state_file.with_suffix(".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, sort_keys=True)
+    os.replace(tmp_file, state_file)
+    return
+
+
+def upload_accepted(response):
+    """
+    :param response: publish() response
+    :return: bool if the uploads API accepted the job
+    """
+    return bool(response) and "id" in response
+
+
+def stage_and_publish(path, file_name, tileset_name, get_creds, s3_client=None, base_url=None):
+    """
+    :param path: folder holding the file
+    :param file_name: geojson file to publish
+    :param tileset_name: tileset to replace
+    :param get_creds: function returning AWS credentials from Mapbox (one staging key per upload)
+    :param s3_client: boto3 S3 client, or None to build one from the credentials
+    :param base_url: uploads API host (defaults to MAPBOX_API_URL)
+    :return: uploads API response, or None if the upload wasn't accepted
+    """
+    creds = get_creds()
+    copy_to_s3(path, file_name, creds, s3_client=s3_client)
+    response = publish(creds, tileset_name=tileset_name, name=Path(file_name).stem, base_url=base_url)
+    if upload_accepted(response):
+        mark_published(path, file_name, response["id"])
+    return response
+
+
+def publish_delta(path, file_name, get_creds=None, s3_client=None, base_url=None, now=None, **poll_kwargs):
+    """
+    Change-aware publishing: features are hashed by project ID and compared with the last publish, and the file is
+    only staged and published to TILESET_NAME when a project was added, updated or deleted
+    The Uploads API can only replace a whole tileset, and the frontend only draws that one, so any change
+    republishes the full file
+    published_features.json is only updated once Mapbox has finished processing the upload
+    :param path: folder holding the geojson file (and published_features.json)
+    :param file_name: geojson file from geojson_creator.py
+    :param get_creds: function returning AWS credentials from Mapbox, with a new staging key on every call
+    (defaults to get_aws_creds(renew=True))
+    :param s3_client: boto3 S3 client, or None to build one from the credentials
+    :param base_url: uploads API host (defaults to MAPBOX_API_URL)
+    :param now: current time (for testing)
+    :param poll_kwargs: keyword arguments for wait_for_upload()
+    :return: report dictionary: "mode" ("published" or "unchanged"), the add/update/delete counts and
+    "error" (None, or why the publish failed and was left to the next run)
+    """
+    now = now or datetime.now()
+    get_creds = get_creds or (lambda: get_aws_creds(renew=True))
+    features = read_features(Path(path, file_name))
+    hashes = feature_hashes(features)
+    state = load_delta_state(path)
+    changeset = diff_features(features, state["published"] if state is not None else {})
+    counts = {k: len(v) for k, v in changeset.items()}
+    if state is not None and not any(counts.values()):
+        print("No project changed since the last publish")
+        return dict(mode="unchanged", **counts, error=None)
+    print("Publishing {} features: {add} added, {update} updated, {delete} deleted".format(len(features), **counts))
+    report = dict(mode="published", **counts, error=None)
+    try:
+        response = stage_and_publish(path, file_name, TILESET_NAME, get_creds, s3_client, base_url)
+        if not upload_accepted(response):
+            report["error"] = "upload not accepted: {}".format(response)
+        else:
+            report["error"] = wait_for_upload(response["id"], base_url, **poll_kwargs).get("error")
+    except Exception as e:  # ex: S3 or credential errors; the next run tries again
+        report["error"] = "{}: {}".format(type(e).__name__, e)
+    if report["error"] is not None:
+        print("Publish failed, keeping the last published state:", report["error"])
+        return report
+    save_delta_state({"published": hashes, "time": now.isoformat()}, path)
+    return report
+
+def main(delta=False):
     path = "/Users/derekwacks/Documents/Interconnection/code/data"
     file_name = "interconnection2.geojson"
+    if delta:
+        print(publish_delta(path, file_name))
+        return
     creds = get_aws_creds(overwrite_keys=False)
     print("Creds:", creds)
-    copy_to_s3(path, file_name, creds)
-    pub_response = publish(creds)
-    print(pub_response)
+    if copy_to_s3(path, file_name, creds) or not is_published(path, file_name):
+        pub_response = publish(creds)
+        print(pub_response)
+        if pub_response and "id" in pub_response:
+            mark_published(path, file_name, pub_response["id"])
+    else:
+        print("Tileset already built from this file")
     return
 
 if __name__ == "__main__":
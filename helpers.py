@@ -2,14 +2,21 @@
 helpers.py
 Helper functions (mainly regarding CSV operations)
 """
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from openpyxl import load_workbook
+import frame_cache as fc
+
+LOCS_NAME = "locs.feather"  # located projects from coordinate_locator.py
+LONGITUDE = "Longitude"
+LATITUDE = "Latitude"
 
 
 def find_type(f_name):
     """
     :param f_name: data file name
-    :return: ".CSV" or ".XSLX"
+    :return: "csv", "xlsx" or "feather"
     """
     ending = f_name.split(".")[-1]
     return ending
@@ -27,10 +34,38 @@ def save_csv(name, d_frame, path):
     return
 
 
+def save_feather(name, d_frame, path):
+    """
+    Binary alternative to save_csv(): keeps column types (ex: float coordinates) and writes NaN as null
+    :param name: new file name to save as (ex: "locs.feather")
+    :param d_frame: data frame to write
+    :param path: path to folder location
+    :return: None
+    """
+    full_path = Path(path, name)
+    d_frame.reset_index(drop=True).to_feather(full_path)
+    return
+
+
+def split_locations(d_frame):
+    """
+    Converts a legacy "Locations" column ("[long, lat]" strings read back from locs.csv) to Longitude/Latitude columns
+    :param d_frame: pandas dataframe with a Locations column
+    :return: d_frame=updated pandas dataframe without Locations
+    """
+    parts = d_frame['Locations'].astype(str).str.strip("[]").str.split(",", n=1, expand=True)
+    parts = parts.reindex(columns=[0, 1])
+    d_frame[LONGITUDE] = pd.to_numeric(parts[0], errors="coerce").astype(np.float64)
+    d_frame[LATITUDE] = pd.to_numeric(parts[1], errors="coerce").astype(np.float64)
+    return d_frame.drop(columns=['Locations'])
+
+
 def create_dataframe_from_file(f_name, full_path, sheet_name):
     f_type = find_type(f_name)
     if f_type == "csv":
         d_frame = pd.read_csv(full_path)
+    elif f_type == "feather":
+        d_frame = pd.read_feather(full_path)
     elif f_type == "xlsx":
         d_frame = pd.read_excel(full_path, sheet_name=sheet_name)
         if sheet_name != 0:
@@ -43,18 +78,141 @@ def create_dataframe_from_file(f_name, full_path, sheet_name):
     return d_frame
 
 
-def check_path_and_load_data(f_name, path_to_data):
+def keep_row(row, filter_idx):
+    """
+    :param row: tuple of cell values
+    :param filter_idx: list of (column index, set of allowed values)
+    :return: bool if every filtered cell holds an allowed value
+    """
+    for i, allowed in filter_idx:
+        if row[i] not in allowed:
+            return False
+    return True
+
+
+def stream_xlsx(full_path, columns, filters, sheet_name):
+    """
+    Reads only the selected columns of a worksheet row by row, dropping rows that fail filters as they are read
+    :param full_path: path to .xlsx file
+    :param columns: list of column names (from the header row) to keep
+    :param filters: dictionary column name -> set of allowed values
+    :param sheet_name: sheet index or name
+    :return: d_frame=pandas data frame of the selected columns and matching rows
+    """
+    workbook = load_workbook(full_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, ())
+        positions = {}
+        for i, name in enumerate(header):
+            positions.setdefault(name, i)  # first column wins if a name repeats
+        missing = [c for c in list(columns) + list(filters.keys()) if c not in positions]
+        if missing:
+            raise KeyError("{} not in header of {}".format(missing, full_path))
+        col_idx = [positions[c] for c in columns]
+        filter_idx = [(positions[c], allowed) for c, allowed in filters.items()]
+        width = max(col_idx + [i for i, _ in filter_idx]) + 1
+        values = [[] for _ in columns]
+        for row in rows:
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            if keep_row(row, filter_idx):
+                for out, i in zip(values, col_idx):
+                    out.append(row[i])
+    finally:
+        workbook.close()
+    d_frame = pd.DataFrame({c: pd.Series(v, dtype=object) for c, v in zip(columns, values)})
+    d_frame = d_frame.infer_objects().fillna(np.nan)
+    return d_frame
+
+
+def stream_csv(full_path, columns, filters, chunksize=100000):
+    """
+    Reads only the selected columns of a .csv in chunks, dropping rows that fail filters chunk by chunk
+    :param full_path: path to .csv file
+    :param columns: list of column names to keep
+    :param filters: dictionary column name -> set of allowed values
+    :param chunksize: rows per chunk
+    :return: d_frame=pandas data frame of the selected columns and matching rows
+    """
+    usecols = list(dict.fromkeys(list(columns) + list(filters.keys())))
+    chunks = []
+    for chunk in pd.read_csv(full_path, usecols=usecols, chunksize=chunksize):
+        for c, allowed in filters.items():
+            chunk = chunk[chunk[c].isin(allowed)]
+        chunks.append(chunk[list(columns)])
+    if not chunks:
+        return pd.DataFrame(columns=list(columns))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def stream_dataframe_from_file(f_name, full_path, columns, filters=None, sheet_name=0):
+    """
+    Column-pruned, filtered read; memory use follows the size of the output rather than the file
+    :param f_name: data file name
+    :param full_path: path to data file
+    :param columns: list of column names to keep
+    :param filters: dictionary column name -> set of allowed values (ex: {"Type": {"W"}})
+    :param sheet_name: sheet index or name for .xlsx files
+    :return: d_frame=pandas data frame
+    """
+    filters = filters or {}
+    f_type = find_type(f_name)
+    if f_type == "csv":
+        d_frame = stream_csv(full_path, columns, filters)
+    elif f_type == "xlsx":
+        d_frame = stream_xlsx(full_path, columns, filters, sheet_name)
+    else:
+        d_frame = pd.DataFrame()
+    return d_frame
+
+
+def check_path_and_stream_data(f_name, path_to_data, columns, filters=None, use_cache=True):
+    """
+    Streaming version of check_path_and_load_data(), see stream_dataframe_from_file()
+    :param f_name: name of data file
+    :param path_to_data: path to data file
+    :param columns: list of column names to keep
+    :param filters: dictionary column name -> set of allowed values
+    :param use_cache: bool to read from/write to the frame cache
+    :return: d_frame=data frame d_frame from pandas
+    """
+    sheet_name = 0
+    full_path = Path(path_to_data, f_name)
+    print("Streaming:", full_path)
+    if full_path.exists():
+        def loader():
+            return stream_dataframe_from_file(f_name, full_path, columns, filters, sheet_name)
+        if use_cache:
+            variant = repr((list(columns), sorted((c, sorted(map(str, v))) for c, v in (filters or {}).items())))
+            d_frame = fc.cached_load(full_path, sheet_name, loader, variant=variant)
+        else:
+            d_frame = loader()
+        return d_frame
+    else:
+        print("Error: {} not found".format(f_name))
+        return pd.DataFrame()
+
+
+def check_path_and_load_data(f_name, path_to_data, use_cache=True):
     """
     Loads data file into pandas DF
+    Parsed frames are kept in a Feather cache (see frame_cache.py) until the source file changes
     :param f_name: name of data file
     :param path_to_data: path to data file
+    :param use_cache: bool to read from/write to the frame cache
     :return: d_frame=data frame d_frame from pandas
     """
     sheet_name = 0  # sheet_name=None to get all sheets
     full_path = Path(path_to_data, f_name)
     print("Loading:", full_path)
     if full_path.exists():
-        d_frame = create_dataframe_from_file(f_name, full_path, sheet_name)
+        if use_cache and find_type(f_name) != "feather":  # feather files are already as fast as the cache
+            d_frame = fc.cached_load(full_path, sheet_name,
+                                     lambda: create_dataframe_from_file(f_name, full_path, sheet_name))
+        else:
+            d_frame = create_dataframe_from_file(f_name, full_path, sheet_name)
         return d_frame
     else:
         print("Error: {} not found".format(f_name))
@@ -1,3 +1,10 @@
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.naive_bayes import CategoricalNB, MultinomialNB
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import OneHotEncoder
 import matplotlib.pyplot as plt
 import warnings
 import matplotlib
@@ -11,4 +18,70 @@ def plotting(dataframe, labels=None):
     y = dataframe.iloc[:, 1]
     plt.plot(x,y, ".")
     plt.show()
-    return
\ No newline at end of file
+    return
+
+
+class LinearProbability(LinearRegression):
+    """
+    Least squares fit used as a classifier: predictions clipped to [0, 1] as P(indicator=1)
+    """
+    def predict_proba(self, x):
+        p = np.clip(self.predict(x), 0.0, 1.0)
+        return np.column_stack([1 - p, p])
+
+
+class StatsmodelsBinary:
+    """
+    statsmodels Logit or Probit (no constant) with fit() and predict_proba() like the sklearn models
+    """
+    def __init__(self, link="logit", disp=False):
+        """
+        :param link: "logit" or "probit"
+        :param disp: bool to print the optimizer's convergence messages
+        """
+        self.link = link
+        self.disp = disp
+
+    def fit(self, x, y):
+        model = sm.Probit(y, x) if self.link == "probit" else sm.Logit(y, x)
+        self.result = model.fit(disp=self.disp)
+        return self
+
+    def predict_proba(self, x):
+        p = np.asarray(self.result.predict(x))
+        return np.column_stack([1 - p, p])
+
+
+def categorical_nb(x):
+    """
+    :param x: full feature matrix of non-negative integer categories (dense)
+    :return: unfitted CategoricalNB that knows every category in x, including ones missing from the training rows
+    """
+    return CategoricalNB(min_categories=(np.asarray(x).max(axis=0) + 1).astype(int))
+
+
+def multinomial_nb(x):
+    """
+    :param x: full feature matrix (unused; every model builder takes it)
+    :return: unfitted one-hot encoder + MultinomialNB pipeline ("vectorized" data in models.naive_bayes())
+    """
+    return make_pipeline(OneHotEncoder(handle_unknown="ignore"), MultinomialNB())
+
+
+def one_hot_categorical_nb(x):
+    """
+    :param x: full feature matrix (unused; every model builder takes it)
+    :return: unfitted one-hot encoder + CategoricalNB pipeline, each indicator column is a 0/1 category
+    """
+    return make_pipeline(OneHotEncoder(handle_unknown="ignore", sparse_output=False), CategoricalNB(min_categories=2))
+
+
+# Model name -> function of the full feature matrix returning an unfitted model with fit() and predict_proba()
+ESTIMATORS = {
+    "categorical_nb": categorical_nb,
+    "multinomial_nb": multinomial_nb,
+    "linear": lambda x: LinearProbability(),
+    "logistic": lambda x: LogisticRegression(),
+    "logit": lambda x: StatsmodelsBinary("logit"),
+    "probit": lambda x: StatsmodelsBinary("probit"),
+}
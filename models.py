@@ -1,100 +1,90 @@
 import pandas as pd
 import numpy as np
-from sklearn.naive_bayes import MultinomialNB, CategoricalNB
+from sklearn.naive_bayes import MultinomialNB
 import matplotlib.pyplot as plt
 import warnings
 import matplotlib
 warnings.filterwarnings("ignore", category=matplotlib.MatplotlibDeprecationWarning)
-import statsmodels.api as sm
-from sklearn.metrics import accuracy_score, confusion_matrix
-from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.metrics import accuracy_score, confusion_matrix, log_loss
+from sklearn.linear_model import LogisticRegression
+import contingency as ct
+import model_helpers as mdlhp
 
 
-def create_probs(merged_data):
+def create_probs(merged_data, engine=None, alpha=0.0):
     """
     :param merged_data: n x 2 matrix where 1st column is amenity value [1,5], and second is indicator value [0,1]
-    :return:
+    :param engine: contingency.ContingencyEngine for merged_data (to reuse its cached tables), or None
+    :param alpha: Laplace smoothing pseudo-count (0 for raw frequencies)
+    :return: pandas df of each amenity value and the probability a project there is successful
     """
-    # Collecting data
-    amenity_counts = merged_data.NaturalAmenityTier.value_counts()  # counts of amenity indicies across all data
-    amenity_counts = pd.DataFrame(amenity_counts)
-    num_points = amenity_counts.sum()  # count of all points
-    in_service_data = merged_data.loc[merged_data["indicator"] == 1]  # all data, filtered for successful projects
-    success_counts = in_service_data.NaturalAmenityTier.value_counts()  # counts of amenity indicies across successful projects
-    success_counts = pd.DataFrame(success_counts)
-    num_success = success_counts.sum()  # count of successful projects
-    # Assembling bayes rule
-    pr_a_given_s = success_counts / num_success  # probability of each amenity value given the amenity value is from a successful proj.
-    p_s = num_success / num_points  # probability of a successful project
-    p_a = amenity_counts / num_points  # probability of getting each amenity value
-    freqs = pr_a_given_s * p_s / p_a  # bayes rule
-    freqs = freqs.reset_index()  # include amenity values as a column
+    engine = engine or ct.ContingencyEngine(merged_data)
+    table = engine.table("NaturalAmenityTier", alpha)
+    # Bayes rule: P(success | amenity) = P(amenity | success) * P(success) / P(amenity)
+    freqs = table["p_success_given_x"].rename("pr_success").reset_index()  # include amenity values as a column
     print(freqs)
-    print(amenity_counts)
+    print(table["n"])
     return freqs
 
 
-def rebuild_into_vec(amenity):
-    """
-    Function to apply to pandas data frame cell, turns amenity index into indicator vector
-    3 -> 0,0,1,0,0,0,0
-    :param amenity: int amenity value
-    :return: vector with 1 at amenity index (indexed from 1)
-    """
-    val = int(amenity)
-    vec = [0]*7
-    vec[val-1] = 1
-    vec = np.array(vec)
-    return vec
-
-
-def bayes(merged_data):
+def bayes(merged_data, engine=None):
     """
     WIP
     A napkin math answer to: What is the probability a project will withdrawal given there is opposition?
     This is incorrectly blurring the line between withdrawn projects and counties
     :param merged_data:
-    :return:
+    :param engine: contingency.ContingencyEngine for merged_data (to reuse its cached tables), or None
+    :return: dictionary of the probabilities
     """
-    withdrawn_count = merged_data['indicator'].value_counts()[0]
-    in_service_count = merged_data['indicator'].value_counts()[1]
-    rb_withdrawn_count = len(merged_data[(merged_data["Opposed"]==1) & (merged_data["indicator"]==0)])
-    pr_opp_given_withdrawn = rb_withdrawn_count / withdrawn_count
-    pr_withdrawn = withdrawn_count / (withdrawn_count + in_service_count)
-    # Number of unique counties in the Bryce database / number of unique counties in the natural amenities database
-    pr_opp = 121 / 3110
-    pr_withdrawn_given_opp = (pr_opp_given_withdrawn * pr_withdrawn) / pr_opp
+    engine = engine or ct.ContingencyEngine(merged_data)
+    opposed = engine.table("Opposed")
+    pr_withdrawn = 1 - engine.p_success()
+    pr_opp_given_withdrawn = opposed["p_x_given_withdrawn"].get(1, 0.0)
+    # Share of projects in opposed counties (measured, instead of the old 121 / 3110 county ratio)
+    pr_opp = opposed["p_x"].get(1, 0.0)
+    pr_withdrawn_given_opp = (pr_opp_given_withdrawn * pr_withdrawn) / pr_opp if pr_opp else float("nan")
     print(pr_opp_given_withdrawn)
     print(pr_withdrawn)
     print(pr_opp)
     print(pr_withdrawn_given_opp)
-    return
+    return {"pr_opp_given_withdrawn": pr_opp_given_withdrawn, "pr_withdrawn": pr_withdrawn, "pr_opp": pr_opp,
+            "pr_withdrawn_given_opp": pr_withdrawn_given_opp}
 
 
-def naive_bayes(merged_data, params):
+def naive_bayes(merged_data, params, return_model=False):
+    """
+    :param merged_data: matrix with feature columns and the indicator column
+    :param params: dictionary of data_version, printing and model_type (see nb_param_selector_and_driver()),
+    and optionally the columns to one-hot encode for data_version "vectorized" (default: every column but indicator)
+    :param return_model: bool to also return the fitted model; for "vectorized" data it is an encoder + naive bayes
+    pipeline, so new rows in the same columns can be passed to it directly
+    :return: dictionary of test metrics and params, or (dictionary, fitted model) if return_model
+    """
     data_version = params["data_version"]
     printing = params["printing"]
     model_type = params["model_type"]
+    y = merged_data["indicator"].to_numpy()
+    test_split = int(len(y) / 5 * 4)  # 80/20 split
     if data_version == "vectorized":  # Create each x feature as an indicator vector
-        merged_data["vec"] = merged_data["NaturalAmenityTier"].apply(rebuild_into_vec)
-        x_orig = merged_data["vec"]
-        x = np.stack(x_orig, axis=0)
+        columns = params.get("columns", [c for c in merged_data.columns if c != "indicator"])
+        # strings and numbers in one column (ex: Developer Name) can't be sorted together, so encode text labels
+        x = merged_data[columns].apply(lambda c: c.where(c.isna(), c.astype(str)) if c.dtype == object else c)
     elif data_version == "numerical":  # Create each x feature as a float value amenity tier
-        x_orig = merged_data.iloc[:, 0]
+        x_orig = merged_data.drop(columns="indicator").iloc[:, 0]
         x = np.array(x_orig).reshape((-1, 1))
-    y_orig = merged_data.iloc[:, 1]
-    y = np.array(y_orig)
     # Create train and test sets
-    test_split = int(len(x) / 5 * 4)  # 80/20 split
     x_test = x[test_split:]
     y_test = y[test_split:]
     x = x[:test_split]
     y = y[:test_split]
     # Create and fit model
-    if model_type == "multi":
+    if data_version == "vectorized":  # the encoder learns its vocabulary from the training rows only
+        builder = mdlhp.multinomial_nb if model_type == "multi" else mdlhp.one_hot_categorical_nb
+        model = builder(x).fit(x, y)  # unseen values in x_test get no indicator column
+    elif model_type == "multi":
         model = MultinomialNB().fit(x, y)
     elif model_type == "categ":
-        model = CategoricalNB().fit(x, y)
+        model = mdlhp.categorical_nb(np.concatenate([x, x_test])).fit(x, y)  # test tiers missing from training
     # Make predictions on test set
     yhat_prob = model.predict_proba(x_test)  # make a probabilistic prediction
     yhat_class = model.predict(x_test)  # make a classification prediction
@@ -104,14 +94,18 @@ def naive_bayes(merged_data, params):
         print("Predicted Class: ", yhat_class)
         print("True Class: ", y_test)
         print("PARAMS", model.get_params(), "\n")
-    return
+    metrics = {"accuracy": accuracy_score(y_test, yhat_class),
+               "log_loss": log_loss(y_test, yhat_prob, labels=model.classes_), "params": params}
+    if return_model:
+        return metrics, model
+    return metrics
 
 
 def nb_param_selector_and_driver(merged_data, choice=1):
     """
     :param merged_data:
     :param choice: parameter set indicator variable (1 == default)
-    :return: None
+    :return: dictionary of test metrics from naive_bayes()
     Naive bayes driver function
     # # # # # # # # # # # # # # #
     data_version = "vectorized" to use be able to use multinomial, or "numerical" to use categorical
@@ -144,8 +138,7 @@ def nb_param_selector_and_driver(merged_data, choice=1):
         params["data_version"] = "vectorized"
         params["printing"] = True
         params["model_type"] = "multi"
-    naive_bayes(merged_data, params)
-    return
+    return naive_bayes(merged_data, params)
 
 
 def regress_linear(dataframe, model_type="linear", plotting_flag=False):
@@ -159,7 +152,7 @@ def regress_linear(dataframe, model_type="linear", plotting_flag=False):
     x = x[:test_split]
     y = y[:test_split]
     if model_type == "linear":
-        model = LinearRegression().fit(x, y)
+        model = mdlhp.LinearProbability().fit(x, y)
     else:
         model = LogisticRegression().fit(x,y)
 
@@ -183,7 +176,7 @@ def regress_linear(dataframe, model_type="linear", plotting_flag=False):
         # evaluate the distribution of the residuals
         #sns.distplot(residuals, bins=30)
         plt.xlabel('Residuals')
-    return
+    return {"r_squared": r_sq, "slope": model.coef_.tolist(), "intercept": np.ravel(model.intercept_).tolist()}
 
 
 def svm_model(dataframe, path):
@@ -220,18 +213,14 @@ def regress_statsmodel(dataframe, model_type="logit", plotting_flag=False):
     y = y[:test_split]
 
     # Train
-    if model_type == "probit":
-        model = sm.Probit(y, x)
-    elif model_type == "logit":
-        model = sm.Logit(y, x)
-
-    logistic_reg = model.fit()
+    logistic_reg = mdlhp.StatsmodelsBinary(model_type, disp=True).fit(x, y).result
     print(logistic_reg.summary())
 
     # Test
     y_hat = logistic_reg.predict(x_test)
     predictions = list(map(round, y_hat))
-    print("Test accuracy=", accuracy_score(y_test, predictions))
+    accuracy = accuracy_score(y_test, predictions)
+    print("Test accuracy=", accuracy)
     x_test = x_test.flatten()
     cm = pd.crosstab(y_test, predictions)
     print("Confusion Matrix\n", cm)
@@ -243,4 +232,5 @@ def regress_statsmodel(dataframe, model_type="logit", plotting_flag=False):
         plt.xlabel('Independent variable x')
         plt.show()
         plt.xlabel('Residuals')
-    return
+    return {"accuracy": accuracy, "coefficients": np.asarray(logistic_reg.params).tolist(),
+            "confusion_matrix": cm.to_dict()}
@@ -6,8 +6,9 @@ import numpy as np
 import pandas as pd
 import json
 from pathlib import Path
-import re
 import helpers as hp
+import normalization as nz
+import geography as geo
 import state_names as sn
 
 
@@ -55,22 +56,7 @@ def reformat(cell, item="County", include_county=True):
     :param include_county: bool to determine if the string "County" is included
     :return: cell=cleaned cell string
     """
-    cell = cell[7:-1]
-    cell = re.sub(r'[^\w\s]', '', cell)
-    cell = cell.split(" ")[1:-1]
-    if len(cell) > 0:
-        try:
-            if include_county:
-                cell[0] = cell[0].replace("County", " County")
-            else:
-                cell[0] = cell[0].replace("County", "")
-            if item == "County":
-                cell = cell[0]
-            else:
-                cell = cell[1]
-        except:
-            print("Couldn't add space: \"County\" not found in ", cell)
-    return cell
+    return nz.reformat_cell(cell, item=item, include_county=include_county)
 
 
 def apply_to_df(df):
@@ -80,8 +66,8 @@ def apply_to_df(df):
     :param df: pandas dataframe to clean data and rename columns of
     :return: amenities=cleaned and reformatted dataframe
     """
-    df['County_clean'] = df['County'].apply(reformat, item="County", include_county=False)
-    df['State_clean'] = df['County'].apply(reformat, item="State", include_county=False)
+    df['County_clean'] = nz.reformat(df['County'], item="County", include_county=False)
+    df['State_clean'] = nz.reformat(df['County'], item="State", include_county=False)
     amenities = df[['State', 'County', 'County_clean', 'State_clean', 'NaturalAmenityTier', 'NaturalAmenityRank']]
     names = {'County': 'County_clean', 'County_clean': 'County', 'State': 'State_clean', 'State_clean': 'State'}
     amenities = amenities.rename(columns=names)
@@ -93,6 +79,7 @@ def main():
     f_name = "Natural-Amenities-by-US-County.csv"
     df = hp.check_path_and_load_data(f_name, path_to_data)
     amenities = apply_to_df(df)
+    amenities = geo.add_county_ids(amenities, geo.load_registry(path_to_data))
     name = "Natural_Amenities_by_County_cleaned.csv"
     hp.save_csv(name, amenities, path_to_data)
     return
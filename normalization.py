@@ -0,0 +1,216 @@
+"""
+normalization.py
+Vectorized county and state name cleaning shared by queue_parser.py, natural_amenity_parser.py and bryce_parser.py
+Each function takes a pandas Series and returns the same values the per-cell functions in those files return
+"""
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+import state_names as sn
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+# Last "County" token (split on single spaces) that has a token before it
+COUNTY_PREFIX = re.compile(r'^(.*) County(?= |\Z)', re.DOTALL)
+COUNTY_WORD = re.compile(r'^(?:.* )?([^ ]*) County(?= |\Z)', re.DOTALL)
+
+
+def is_text(series):
+    """
+    :param series: pandas Series
+    :return: bool if the series can hold strings (the .str accessor only works on these)
+    """
+    return series.dtype == object or pd.api.types.is_string_dtype(series)
+
+
+def keep_non_strings(result, series):
+    """
+    .str methods return NaN for cells that aren't strings; put the original cells back
+    :param result: output of a .str method on series
+    :param series: original pandas Series
+    :return: result with non-string cells restored from series
+    """
+    return result.where(result.notna(), series)
+
+
+def map_unique(series, func, **kwargs):
+    """
+    Applies func once per distinct value instead of once per row
+    Missing cells are returned unchanged
+    :param series: pandas Series
+    :param func: per-cell function
+    :param kwargs: keyword arguments passed to func
+    :return: pandas Series of func outputs with the index of series
+    """
+    codes, uniques = pd.factorize(series)
+    mapped = np.empty(len(uniques), dtype=object)
+    for i, value in enumerate(uniques):
+        mapped[i] = func(value, **kwargs)
+    out = np.empty(len(series), dtype=object)
+    found = codes >= 0
+    out[found] = mapped[codes[found]]
+    out[~found] = series.to_numpy(dtype=object)[~found]
+    return pd.Series(out, index=series.index, name=series.name).infer_objects()
+
+
+def on_uniques(series, transform):
+    """
+    Runs a vectorized string transform over the distinct values of series and expands the result back
+    Queue columns repeat a few hundred names across many rows, so this is much cheaper than transforming every row
+    :param series: pandas Series of strings
+    :param transform: function taking and returning a pandas Series (.str methods)
+    :return: transformed series with non-string cells left unchanged
+    """
+    codes, uniques = pd.factorize(series)
+    cleaned = transform(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+    out = np.full(len(series), np.nan, dtype=object)
+    found = codes >= 0
+    out[found] = cleaned[codes[found]]
+    result = pd.Series(out, index=series.index, name=series.name)
+    return keep_non_strings(result, series)
+
+
+def remove_spaces(series):
+    """
+    Vectorized queue_parser.remove_spaces
+    :param series: pandas Series of names
+    :return: series with spaces removed
+    """
+    if not is_text(series):
+        return series.copy()
+    return on_uniques(series, lambda s: s.str.replace(" ", "", regex=False))
+
+
+def expand_state_names(series):
+    """
+    Vectorized queue_parser.expand_state_name, NY->New York using dict in state_names.py
+    :param series: pandas Series of state abbreviations
+    :return: series with known abbreviations replaced by full state names
+    """
+    expanded = series.map(sn.all_states)
+    return expanded.where(expanded.notna(), series)
+
+
+def remove_county(series):
+    """
+    Vectorized queue_parser.remove_county, removes " County" and punctuation from county names
+    :param series: pandas Series of county names
+    :return: cleaned series
+    """
+    if not is_text(series):
+        return series.copy()
+    return on_uniques(series, lambda s: s.str.replace(PUNCTUATION, "", regex=True)
+                      .str.replace(" County", "", regex=False))
+
+
+def reformat_cell(cell, item="County", include_county=True):
+    """
+    Reformats and cleans a County or State name string from the natural amenity data
+    ex: '{"County": "AutaugaCounty Alabama"}'-style strings
+    :param cell: cell containing the County or State name string
+    :param item: type ("County", or another string)
+    :param include_county: bool to determine if the string "County" is included
+    :return: cell=cleaned cell string
+    """
+    cell = cell[7:-1]
+    cell = PUNCTUATION.sub('', cell)
+    cell = cell.split(" ")[1:-1]
+    if len(cell) > 0:
+        try:
+            if include_county:
+                cell[0] = cell[0].replace("County", " County")
+            else:
+                cell[0] = cell[0].replace("County", "")
+            if item == "County":
+                cell = cell[0]
+            else:
+                cell = cell[1]
+        except IndexError:
+            print("Couldn't add space: \"County\" not found in ", cell)
+    return cell
+
+
+def reformat(series, item="County", include_county=True):
+    """
+    Vectorized natural_amenity_parser.reformat, cleans each distinct string once
+    :param series: pandas Series of raw County strings from the natural amenity data
+    :param item: type ("County", or another string)
+    :param include_county: bool to determine if the string "County" is included
+    :return: cleaned series
+    """
+    return map_unique(series, reformat_cell, item=item, include_county=include_county)
+
+
+def get_county(series, ver):
+    """
+    Vectorized bryce_parser.get_county
+    :param series: pandas Series of "Entity" or "Government" strings
+    :param ver: 1 to return every word before "County", 2 to return only the word before it
+    :return: series of county names, NaN where no county was found
+    """
+    pattern = COUNTY_PREFIX if ver == 1 else COUNTY_WORD
+    if not is_text(series) or ver not in (1, 2):
+        return pd.Series(np.nan, index=series.index, name=series.name, dtype=object)
+    codes, uniques = pd.factorize(series)
+    names = pd.Series(uniques, dtype=object).str.extract(pattern, expand=False).to_numpy(dtype=object)
+    out = np.full(len(series), np.nan, dtype=object)
+    found = codes >= 0
+    out[found] = names[codes[found]]
+    return pd.Series(out, index=series.index, name=series.name)
+
+
+COUNTY_SUFFIX = re.compile(r'\s+(county|parish|borough|census area|city and borough|municipality)$')
+NON_ALNUM = re.compile(r'[^0-9a-z]')
+
+
+def fold_accents(cell):
+    """
+    :param cell: string
+    :return: cell with accented letters replaced by their base letters (ex: "Doña Ana" -> "Dona Ana")
+    """
+    return "".join(c for c in unicodedata.normalize("NFKD", cell) if not unicodedata.combining(c))
+
+
+def county_key(cell):
+    """
+    Matching key for a county name: lower case, no punctuation or spaces, no "County"/"Parish"/... suffix
+    ex: "St. Lawrence County" -> "stlawrence", "Prince George's" -> "princegeorges", "Doña Ana" -> "donaana"
+    Independent cities keep their "city" suffix so "Richmond city" and "Richmond County" stay distinct
+    :param cell: county name string
+    :return: key string, or NaN if cell isn't a string
+    """
+    if not isinstance(cell, str):
+        return np.nan
+    cell = " ".join(PUNCTUATION.sub('', fold_accents(cell)).lower().split())
+    cell = COUNTY_SUFFIX.sub('', cell)
+    return NON_ALNUM.sub('', cell)
+
+
+def state_key(cell):
+    """
+    Matching key for a state: abbreviations are expanded, then lower case without spaces
+    ex: "NY", "New York" and "NewYork" -> "newyork"
+    :param cell: state name or abbreviation string
+    :return: key string, or NaN if cell isn't a string
+    """
+    if not isinstance(cell, str):
+        return np.nan
+    cell = cell.strip()
+    cell = sn.all_states.get(cell.upper(), cell) if len(cell) == 2 else cell
+    return NON_ALNUM.sub('', fold_accents(cell).lower())
+
+
+def county_keys(series):
+    """
+    :param series: pandas Series of county names
+    :return: pandas Series of county_key() values
+    """
+    return map_unique(series, county_key)
+
+
+def state_keys(series):
+    """
+    :param series: pandas Series of state names or abbreviations
+    :return: pandas Series of state_key() values
+    """
+    return map_unique(series, state_key)
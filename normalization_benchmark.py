@@ -0,0 +1,168 @@
+"""
+normalization_benchmark.py
+Checks that the vectorized cleaners in normalization.py match the original per-cell functions,
+and times both on a synthetic queue
+"""
+import argparse
+import re
+import time
+import numpy as np
+import pandas as pd
+import normalization as nz
+import state_names as sn
+
+
+# Original per-cell implementations, kept as they were (minus printing) as the reference
+def legacy_remove_spaces(cell):
+    if not pd.isna(cell):
+        cell = cell.replace(" ", "")
+    return cell
+
+
+def legacy_expand_state_name(cell):
+    if cell in sn.all_states.keys():
+        cell = sn.all_states[cell]
+    return cell
+
+
+def legacy_remove_county(cell):
+    if type(cell) is str:
+        cell = re.sub(r'[^\w\s]', '', cell)
+        if " County" in cell:
+            cell = cell.replace(" County", "")
+    return cell
+
+
+def legacy_reformat(cell, item="County", include_county=True):
+    cell = cell[7:-1]
+    cell = re.sub(r'[^\w\s]', '', cell)
+    cell = cell.split(" ")[1:-1]
+    if len(cell) > 0:
+        try:
+            if include_county:
+                cell[0] = cell[0].replace("County", " County")
+            else:
+                cell[0] = cell[0].replace("County", "")
+            if item == "County":
+                cell = cell[0]
+            else:
+                cell = cell[1]
+        except:
+            pass
+    return cell
+
+
+def legacy_get_county(cell, ver):
+    name = np.nan
+    if "County" in cell:
+        cell = cell.split(" ")
+        for i in range(len(cell)):
+            if cell[i] == "County" and (i-1) < len(cell) and i >= 1:
+                if ver == 1:
+                    name = " ".join(cell[:i])
+                elif ver == 2:
+                    name = cell[i-1]
+    return name
+
+
+def synthetic_queue(n_rows, seed=0):
+    """
+    Creates a fake queue with the kinds of County/State/Entity strings found in the real data
+    :param n_rows: number of rows
+    :param seed: random seed
+    :return: pandas dataframe with County, State, Amenity and Entity columns
+    """
+    rng = np.random.default_rng(seed)
+    counties = ["Albany County", "St. Lawrence", "Erie County", "Prince George's County", "Lewis and Clark",
+                "Dona Ana  County", "County Line", "Miami-Dade County", "Ogle", "", " ", np.nan,
+                "Doña Ana County", "Saint-Jérôme", "Ñuñoa County", "Allen County\n", "Lee County\n "]
+    states = list(sn.all_states.keys()) + ["New York", "Ontario", "", " ", "Québec", np.nan]
+    amenities = ['{"a": "1 AutaugaCounty Alabama x"}', '{"a": "2 NewYorkCounty NewYork x"}',
+                 '{"a": "3 DoñaAnaCounty NewMexico x"}', '{"a": "4 Juneau x"}', '{"a": "5 x"}', "short"]
+    entities = ["Allen County Commission", "Town of Ball County Board County", "County Planning Board",
+                "Bath Township", "Lee County", "Adams  County Zoning", "Sherman Township Board", "", "County",
+                "Doña Ana County Commission", "Allen County\n", "Bath Township County\n"]
+    return pd.DataFrame({
+        "County": rng.choice(np.array(counties, dtype=object), n_rows),
+        "State": rng.choice(np.array(states, dtype=object), n_rows),
+        "Amenity": rng.choice(np.array(amenities, dtype=object), n_rows),
+        "Entity": rng.choice(np.array(entities, dtype=object), n_rows),
+    })
+
+
+def cases(data):
+    """
+    :param data: synthetic queue from synthetic_queue()
+    :return: list of (name, per-cell version, vectorized version)
+    """
+    return [
+        ("remove_spaces", lambda: data["State"].apply(legacy_remove_spaces),
+         lambda: nz.remove_spaces(data["State"])),
+        ("expand_state_name", lambda: data["State"].apply(legacy_expand_state_name),
+         lambda: nz.expand_state_names(data["State"])),
+        ("remove_county", lambda: data["County"].apply(legacy_remove_county),
+         lambda: nz.remove_county(data["County"])),
+        ("reformat County", lambda: data["Amenity"].apply(legacy_reformat, item="County", include_county=False),
+         lambda: nz.reformat(data["Amenity"], item="County", include_county=False)),
+        ("reformat State", lambda: data["Amenity"].apply(legacy_reformat, item="State", include_county=True),
+         lambda: nz.reformat(data["Amenity"], item="State", include_county=True)),
+        ("get_county ver=1", lambda: data["Entity"].apply(legacy_get_county, ver=1),
+         lambda: nz.get_county(data["Entity"], ver=1)),
+        ("get_county ver=2", lambda: data["Entity"].apply(legacy_get_county, ver=2),
+         lambda: nz.get_county(data["Entity"], ver=2)),
+    ]
+
+
+def same_values(a, b):
+    """
+    :return: bool if two Series hold the same cells (NaN == NaN, lists compared by value)
+    """
+    if len(a) != len(b) or not a.index.equals(b.index):
+        return False
+    for x, y in zip(a.to_numpy(dtype=object), b.to_numpy(dtype=object)):
+        if isinstance(x, float) and isinstance(y, float) and np.isnan(x) and np.isnan(y):
+            continue
+        if type(x) is not type(y) or x != y:
+            return False
+    return True
+
+
+def check(check_rows):
+    """
+    :param check_rows: number of synthetic rows (including NaN, empty, blank and non-ASCII names) to compare on
+    :return: list of names of the cases where the vectorized cleaner differs from the original
+    """
+    small = synthetic_queue(check_rows, seed=1)
+    failed = []
+    for name, legacy, vectorized in cases(small):
+        identical = same_values(legacy(), vectorized())
+        print("{:<20} identical: {}".format(name, identical))
+        if not identical:
+            failed.append(name)
+    return failed
+
+
+def main(n_rows, check_rows):
+    failed = check(check_rows)
+    if failed:
+        raise SystemExit("Vectorized cleaners differ from the originals: {}".format(", ".join(failed)))
+    data = synthetic_queue(n_rows)
+    print("\nTiming on {} rows".format(n_rows))
+    for name, legacy, vectorized in cases(data):
+        start = time.perf_counter()
+        legacy()
+        legacy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        vectorized()
+        vector_time = time.perf_counter() - start
+        print("{:<20} per-cell {:>7.2f}s  vectorized {:>7.2f}s  speedup {:>6.1f}x".format(
+            name, legacy_time, vector_time, legacy_time / vector_time))
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time vectorized name cleaning")
+    parser.add_argument("--rows", default=1000000, type=int)
+    parser.add_argument("--check-rows", default=20000, type=int)
+    args = parser.parse_args()
+    main(args.rows, args.check_rows)
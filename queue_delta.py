@@ -0,0 +1,162 @@
+"""
+queue_delta.py
+Incremental queue refresh
+Fingerprints each project (ISO + queue Position), compares against the snapshot from the previous run,
+and saves only inserted, updated and withdrawn rows as <ISO>_delta.csv
+"""
+import pandas as pd
+from pathlib import Path
+import helpers as hp
+
+KEY = "Position"
+SNAPSHOT_FOLDER = ".snapshots"
+INSERTED, UPDATED, WITHDRAWN = "inserted", "updated", "withdrawn"
+
+
+def status_from_name(f_name):
+    """
+    :param f_name: queue_parser output name (ex: "NYISO_withdrawn.csv")
+    :return: status string (ex: "withdrawn")
+    """
+    return f_name.split("_")[-1].split(".")[0]
+
+
+def load_iso_frames(f_names, path):
+    """
+    Stacks all status files of one ISO into a single frame with a Status column
+    A project listed in more than one file keeps its last listing (active, then in-service, then withdrawn)
+    :param f_names: list of queue_parser output names for one ISO (ex: "NYISO_active.csv", "NYISO_withdrawn.csv")
+    :param path: path to the CSV files
+    :return: pandas dataframe of every project in the ISO queue
+    """
+    frames = []
+    for f_name in f_names:
+        data = hp.check_path_and_load_data(f_name, path)
+        if data.empty:
+            continue
+        data = data.drop(columns=[c for c in data.columns if c.startswith("Unnamed")])
+        data["Status"] = status_from_name(f_name)
+        frames.append(data)
+    if not frames:
+        return pd.DataFrame()
+    projects = pd.concat(frames, ignore_index=True)
+    projects[KEY] = projects[KEY].astype(str)
+    duplicated = projects[KEY].duplicated(keep="last")
+    if duplicated.any():
+        print("WARNING: {} rows repeat a Position listed earlier (in the same or an earlier status file), "
+              "keeping the last".format(duplicated.sum()))
+        projects = projects[~duplicated]
+    return projects.reset_index(drop=True)
+
+
+def fingerprint_rows(projects):
+    """
+    Hashes every column of each row so any change to a project (including its status) changes its fingerprint
+    :param projects: pandas dataframe from load_iso_frames()
+    :return: pandas Series of hex fingerprint strings
+    """
+    value_cols = sorted(c for c in projects.columns if c != "Fingerprint")
+    hashes = pd.util.hash_pandas_object(projects[value_cols].astype(str), index=False)
+    return hashes.map("{:016x}".format)
+
+
+def snapshot_path(iso, path):
+    return Path(path, SNAPSHOT_FOLDER, iso + "_snapshot.csv")
+
+
+def load_snapshot(iso, path):
+    """
+    :param iso: ISO name (ex: "NYISO")
+    :param path: path to the queue CSV files
+    :return: pandas dataframe of the previous run's projects and fingerprints (empty on the first run)
+    """
+    full_path = snapshot_path(iso, path)
+    if not full_path.exists():
+        return pd.DataFrame(columns=[KEY, "Fingerprint"])
+    return pd.read_csv(full_path, dtype={KEY: str, "Fingerprint": str})
+
+
+def save_snapshot(iso, path, projects):
+    """
+    :param iso: ISO name (ex: "NYISO")
+    :param path: path to the queue CSV files
+    :param projects: pandas dataframe of projects with a Fingerprint column
+    :return: None
+    """
+    full_path = snapshot_path(iso, path)
+    full_path.parent.mkdir(parents=True, exist_ok=True)
+    projects.to_csv(full_path, index=False)
+    return
+
+
+def diff_snapshot(current, previous):
+    """
+    Compares fingerprints keyed by Position
+    :param current: pandas dataframe of this run's projects with a Fingerprint column
+    :param previous: pandas dataframe of the previous run's projects with a Fingerprint column
+    :return: delta=rows of current that are new or changed, plus rows of previous that are gone,
+    with a Change column ("inserted", "updated" or "withdrawn")
+    """
+    keys = current[[KEY, "Fingerprint"]].merge(previous[[KEY, "Fingerprint"]], how="outer", on=KEY,
+                                                suffixes=("", "_previous"), indicator=True)
+    inserted = keys.loc[keys["_merge"] == "left_only", KEY]
+    updated = keys.loc[(keys["_merge"] == "both") & (keys["Fingerprint"] != keys["Fingerprint_previous"]), KEY]
+    withdrawn = keys.loc[keys["_merge"] == "right_only", KEY]
+    parts = [
+        current[current[KEY].isin(inserted)].assign(Change=INSERTED),
+        current[current[KEY].isin(updated)].assign(Change=UPDATED),
+        previous[previous[KEY].isin(withdrawn)].assign(Change=WITHDRAWN),
+    ]
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame(columns=list(current.columns) + ["Change"])
+    return pd.concat(parts, ignore_index=True)
+
+
+def refresh_iso(iso, f_names, path, apply=None):
+    """
+    Creates <ISO>_delta.csv from the current status files and updates the snapshot
+    :param iso: ISO name (ex: "NYISO")
+    :param f_names: list of queue_parser output names for the ISO
+    :param path: path to the queue CSV files
+    :param apply: function of the delta run before the snapshot is updated (ex: data_merger.merge_delta()), or None;
+    if it raises, the snapshot is kept so the next run produces the same changes again
+    :return: delta=pandas dataframe of changes (see diff_snapshot())
+    """
+    current = load_iso_frames(f_names, path)
+    if current.empty:
+        print("Warning: no projects found for", iso)
+        return pd.DataFrame()
+    current["Fingerprint"] = fingerprint_rows(current)
+    previous = load_snapshot(iso, path)
+    delta = diff_snapshot(current, previous)
+    counts = delta["Change"].value_counts()
+    print("{}: {} inserted, {} updated, {} withdrawn".format(
+        iso, counts.get(INSERTED, 0), counts.get(UPDATED, 0), counts.get(WITHDRAWN, 0)))
+    hp.save_csv(iso + "_delta.csv", delta, path)
+    if apply is not None:
+        apply(delta)
+    save_snapshot(iso, path, current)
+    return delta
+
+
+def changed_rows(delta):
+    """
+    :param delta: pandas dataframe from diff_snapshot()
+    :return: rows downstream stages need to (re)process (inserted and updated)
+    """
+    return delta[delta["Change"] != WITHDRAWN].drop(columns=["Change", "Fingerprint"], errors="ignore")
+
+
+def apply_delta(full, delta, key=KEY):
+    """
+    Applies a delta to a downstream table built from an earlier run (ex: merged amenity data or locs.csv)
+    Rows of full that were updated or withdrawn are dropped, then the inserted and updated rows are appended
+    :param full: pandas dataframe from an earlier run, with a key column
+    :param delta: pandas dataframe of delta rows, optionally after a downstream stage added its own columns
+    :param key: project key column
+    :return: updated pandas dataframe
+    """
+    delta_keys = delta[key].astype(str)
+    kept = full[~full[key].astype(str).isin(delta_keys)]
+    return pd.concat([kept, changed_rows(delta)], ignore_index=True)
@@ -3,11 +3,21 @@ queue_parser.py
 Parse through interconnection queue
 Create CSVs of active, in-service, and withdrawn projects with cleaned county names and project type indicators
 """
+import argparse
 import pandas as pd
 import helpers as hp
 from pathlib import Path
 import state_names as sn
-import re
+import normalization as nz
+import queue_delta as qd
+import data_merger as dm
+import geography as geo
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+QUEUE_COLUMNS = ['Position', 'Type', 'County', 'State']
 
 
 def remove_spaces(cell):
@@ -52,12 +62,11 @@ def add_withdrawn_indicator(data_frame, indicator):
 
 def select_columns(projects, incl_developer, fuel_type):
     projects["State_full"] = projects["State"]
-    projects["State"] = projects["State"].apply(expand_state_name)
-    projects["State"] = projects["State"].apply(remove_spaces)
+    projects["State"] = nz.remove_spaces(nz.expand_state_names(projects["State"]))
     projects_of_selected_fuel = projects.loc[projects['Type'] == fuel_type]
     columns = ['Position', 'Type', 'County', 'State_full', 'State', 'Indicator']
     if incl_developer:
-        columns += 'Developer Name'
+        columns += ['Developer Name']
     return projects_of_selected_fuel[columns]
 
 
@@ -107,32 +116,144 @@ def remove_county(cell):
     :return: cell=cleaned cell string
     """
     if type(cell) is str:  # and len(cell) >0:
-        cell = re.sub(r'[^\w\s]', '', cell)
+        cell = nz.PUNCTUATION.sub('', cell)
         if " County" in cell:
             cell = cell.replace(" County", "")
     return cell
 
 
-def create_csv(filename, path, incl_developer):
+def load_queue(filename, path, incl_developer, streaming, fuel_type="W"):
+    """
+    :param filename: file name of .xlsx to load
+    :param path: path to .xlsx file
+    :param incl_developer: bool to keep the developer name column
+    :param streaming: bool to read only the needed columns and fuel_type rows (see helpers.stream_dataframe_from_file)
+    :param fuel_type: project type (ex: "W")
+    :return: pandas dataframe of the queue
+    """
+    if not streaming:
+        return hp.check_path_and_load_data(filename, path)
+    columns = QUEUE_COLUMNS + (['Developer Name'] if incl_developer else [])
+    return hp.check_path_and_stream_data(filename, path, columns, filters={'Type': {fuel_type}})
+
+
+def create_csv(filename, path, incl_developer, streaming=False, registry=None):
     """
     :param f_name: file name of .xlsx to create filtered .CSV of
     :param path: path to read .xlsx files from  (/training)
     and path to save .CSV files to (/training)
+    :param streaming: bool to stream only the needed columns and rows from the .xlsx
+    :param registry: county registry from geography.load_registry() to add CountyID, or None
     :return: None
     """
-    data_frame = hp.check_path_and_load_data(filename, path)
+    data_frame = load_queue(filename, path, incl_developer, streaming)
     indicator = set_status_indicator(filename)
     data_frame = add_withdrawn_indicator(data_frame, indicator)
     data_frame = try_to_select_columns(data_frame, incl_developer, fuel_type="W")  # only pass a single data_frame
-    data_frame['County_clean'] = data_frame['County'].apply(remove_county)  # remove "County" from county names
+    data_frame['County_clean'] = nz.remove_county(data_frame['County'])  # remove "County" from county names
     data_frame = data_frame.rename(columns={'County':'County_clean', 'County_clean':'County'})
+    data_frame = geo.add_county_ids(data_frame, registry)
     print(data_frame)
     if not data_frame.empty:
         name_and_save_dataframe(filename, path, data_frame)
     return
 
 
-def main():
+def timed_create_csv(filename, path, incl_developer, streaming=False, registry=None):
+    """
+    Runs create_csv() for a single file, catching errors so one bad workbook doesn't stop a batch
+    :param filename: file name of .xlsx to create filtered .CSV of
+    :param path: path to read .xlsx files from and save .CSV files to
+    :param incl_developer: bool to keep the developer name column
+    :param streaming: bool to stream only the needed columns and rows from the .xlsx
+    :param registry: county registry from geography.load_registry(), or None
+    :return: dictionary with the file name, seconds elapsed, and error string (None on success)
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        create_csv(filename, path, incl_developer, streaming, registry)
+    except Exception as e:
+        error = "{}: {}\n{}".format(type(e).__name__, e, traceback.format_exc())
+    return {"file": filename, "seconds": time.perf_counter() - start, "error": error}
+
+
+def ingest_files(f_names, path, incl_developer=False, workers=1, streaming=False, registry=None):
+    """
+    Creates the CSV for every (ISO, status) file, across a process pool when workers > 1
+    :param f_names: dictionary ISO -> list of .xlsx file names
+    :param path: path to read .xlsx files from and save .CSV files to
+    :param incl_developer: bool to keep the developer name column
+    :param workers: number of worker processes (1 == serial)
+    :param streaming: bool to stream only the needed columns and rows from each .xlsx
+    :param registry: county registry from geography.load_registry(), or None
+    :return: list of per-file result dictionaries from timed_create_csv(), in input order
+    """
+    filenames = [filename for iso in f_names.keys() for filename in f_names[iso]]
+    if not filenames:
+        return []
+    if workers <= 1:
+        results = [timed_create_csv(filename, path, incl_developer, streaming, registry) for filename in filenames]
+    else:
+        results_by_file = {}
+        with ProcessPoolExecutor(max_workers=min(workers, len(filenames))) as pool:
+            futures = {pool.submit(timed_create_csv, filename, path, incl_developer, streaming, registry): filename
+                       for filename in filenames}
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    results_by_file[filename] = future.result()
+                except Exception as e:  # worker process died
+                    results_by_file[filename] = {"file": filename, "seconds": float("nan"),
+                                                 "error": "{}: {}".format(type(e).__name__, e)}
+        results = [results_by_file[filename] for filename in filenames]
+    return results
+
+
+def report_ingestion(results):
+    """
+    Prints per-file timings and errors
+    :param results: list of per-file result dictionaries from ingest_files()
+    :return: number of files that failed
+    """
+    failed = 0
+    for r in results:
+        status = "ok" if r["error"] is None else "FAILED"
+        print("{:<50} {:>8.2f}s  {}".format(r["file"], r["seconds"], status))
+        if r["error"] is not None:
+            failed += 1
+            print(r["error"])
+    print("{} files, {} failed".format(len(results), failed))
+    return failed
+
+
+def refresh_deltas(f_names, path, results=None):
+    """
+    Incremental mode: compares each ISO's new CSVs with the previous run, saves <ISO>_delta.csv and folds the
+    changed projects into the ISO's merged_<file name>.csv files (see data_merger.merge_delta())
+    ISOs with a file that failed to ingest are skipped, since their CSVs are stale or missing
+    :param f_names: dictionary ISO -> list of .xlsx file names
+    :param path: path to the CSV files
+    :param results: list of per-file result dictionaries from ingest_files(), or None
+    :return: dictionary ISO name -> delta dataframe
+    """
+    failed = {r["file"] for r in results or [] if r["error"] is not None}
+    amenity_index = None
+    deltas = {}
+    for iso in f_names.keys():
+        iso_name = iso.split("_")[0]
+        if failed.intersection(f_names[iso]):
+            print("Skipping {}: a queue file failed to ingest".format(iso_name))
+            continue
+        csv_names = [create_dataframe_save_name(filename) for filename in f_names[iso]]
+        if amenity_index is None:
+            amenity_index = dm.build_amenity_index(dm.load_amenities(path))
+        deltas[iso_name] = qd.refresh_iso(iso_name, csv_names, path,
+                                          apply=lambda delta: dm.merge_delta(csv_names, delta, path, amenity_index))
+    return deltas
+
+
+def main(workers=1, streaming=False, incremental=False):
     path = "/Users/derekwacks/Documents/Interconnection/code/data/training"
     f_names = {
         "NYISO_xlsx_files": ["NYISO-Interconnection-Queue-active.xlsx",
@@ -148,11 +269,23 @@ def main():
                             "PJM-Interconnection-Queue-inservice.xlsx",
                             "PJM-Interconnection-Queue-withdrawn.xlsx",],
     }
-    for iso in f_names.keys():
-        for filename in f_names[iso]:
-            create_csv(filename, path, incl_developer=False)
+    start = time.perf_counter()
+    registry = geo.load_registry(Path(path, ".."))
+    results = ingest_files(f_names, path, incl_developer=False, workers=workers, streaming=streaming,
+                           registry=registry)
+    report_ingestion(results)
+    if incremental:
+        refresh_deltas(f_names, path, results)
+    print("Total time: {:.2f}s".format(time.perf_counter() - start))
     return
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Create cleaned CSVs from interconnection queue workbooks")
+    parser.add_argument("--workers", default=1, type=int, help="number of worker processes (1 == serial)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="read only the needed columns and wind rows from each workbook")
+    parser.add_argument("--incremental", action="store_true",
+                        help="also save <ISO>_delta.csv with the projects that changed since the last run")
+    args = parser.parse_args()
+    main(args.workers, args.streaming, args.incremental)
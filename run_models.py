@@ -2,13 +2,35 @@
 corr_amenity_queues.py
 """
 import argparse
+import json
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+from pathlib import Path
 import numpy as np
 import helpers as hp
 import data_merger as dm
+import geography as geo
+import feature_store as fs
+import contingency as ct
 import models as mdls
 import model_helpers as mdlhp
 
+# Experiment name -> (function in models.py, keyword arguments); the data is the first argument
+EXPERIMENTS = {
+    "bayes": (mdls.bayes, {}),
+    **{"naive_bayes_{}".format(c): (mdls.nb_param_selector_and_driver, {"choice": c}) for c in range(1, 7)},
+    "linear": (mdls.regress_linear, {}),
+    "probit": (mdls.regress_statsmodel, {"model_type": "probit"}),
+    "logit": (mdls.regress_statsmodel, {"model_type": "logit"}),
+}
+# Experiment name -> columns it needs besides NaturalAmenityTier and indicator
+EXPERIMENT_COLUMNS = {"bayes": ["Opposed"]}
+# Experiments that take an engine= keyword, so one ContingencyEngine (and its cached tables) serves the whole batch
+ENGINE_EXPERIMENTS = {"bayes"}
+RESULTS_NAME = "experiment_results.json"
+
 
 def analyze(f_name, path):
     """
@@ -61,15 +83,23 @@ def equal_withdrawn_and_inservice(df):
     return returning_df
 
 
-def format_data_for_exp(f_names, path, cols_to_include):
+def format_data_for_exp(f_names, path, cols_to_include, spill=False, use_store=True):
     """
     :param f_names: names of CSV files to merge with amenity data and create simlified vectors from
     :param path: path to CSV files
+    :param spill: bool to also write the intermediate merged_<file name>.csv files (the matrix is rebuilt, since
+    the merged frames only exist while building it)
+    :param use_store: bool to reuse the matrix saved in the feature store for unchanged inputs
     :return: pandas df of merged data frame as matrix with amenity index and indicator
     """
-    f_names = dm.add_amenity_data_driver(f_names, path)
-    f_names_indic_tuples = dm.add_indicators(f_names)
-    merged_data = dm.create_matrix(f_names_indic_tuples, path, cols_to_include)
+    def builder():
+        return dm.build_matrix_from_files(f_names, path, cols_to_include, spill=spill)
+    if use_store:
+        extra_files = [Path(path, "../", dm.AMENITIES_NAME), Path(path, "../", geo.REGISTRY_NAME)]
+        merged_data = fs.load_or_build(f_names, path, cols_to_include, builder, extra_files=extra_files,
+                                       version=dm.MATRIX_VERSION, rebuild=spill)
+    else:
+        merged_data = builder()
     equalize = False
     if equalize:
         merged_data = equal_withdrawn_and_inservice(merged_data)
@@ -77,7 +107,90 @@ def format_data_for_exp(f_names, path, cols_to_include):
     return merged_data
 
 
-def main(model_choice):
+def to_jsonable(value):
+    """
+    :param value: model output (dictionaries, lists, numpy and pandas values)
+    :return: value with plain Python types, for json.dump
+    """
+    if isinstance(value, dict):
+        return {str(to_jsonable(k)): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        return to_jsonable(value.item())  # a numpy NaN becomes a float NaN, then None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def timed_experiment(name, merged_data, engine=None):
+    """
+    Runs one experiment, catching errors so one failure doesn't stop a batch
+    :param name: key of EXPERIMENTS
+    :param merged_data: pandas df from format_data_for_exp()
+    :param engine: contingency.ContingencyEngine for merged_data, passed to ENGINE_EXPERIMENTS, or None
+    :return: dictionary of the experiment name, metrics, seconds taken and error (None if it ran)
+    """
+    func, kwargs = EXPERIMENTS[name]
+    if name in ENGINE_EXPERIMENTS:
+        kwargs = dict(kwargs, engine=engine)
+    start = time.perf_counter()
+    metrics, error = None, None
+    try:
+        metrics = func(merged_data.copy(), **kwargs)  # some models add columns to their data
+    except Exception:
+        error = traceback.format_exc()
+    return {"experiment": name, "metrics": to_jsonable(metrics), "seconds": time.perf_counter() - start,
+            "error": error}
+
+
+def run_experiments(merged_data, names=None, workers=1):
+    """
+    Runs several experiments on data loaded once, across a process pool when workers > 1
+    :param merged_data: pandas df from format_data_for_exp()
+    :param names: list of EXPERIMENTS keys (defaults to every experiment whose EXPERIMENT_COLUMNS were loaded)
+    :param workers: number of processes
+    :return: list of per-experiment result dictionaries, in the order of names
+    """
+    runnable = [n for n in EXPERIMENTS if set(EXPERIMENT_COLUMNS.get(n, [])) <= set(merged_data.columns)]
+    names = names or runnable
+    unknown = [n for n in names if n not in EXPERIMENTS]
+    if unknown:
+        raise ValueError("Unknown experiments {}, choose from {}".format(unknown, list(EXPERIMENTS)))
+    missing = {n: EXPERIMENT_COLUMNS[n] for n in names if n not in runnable}
+    if missing:
+        raise ValueError("Experiments need columns that weren't loaded: {}".format(missing))
+    engine = ct.ContingencyEngine(merged_data) if ENGINE_EXPERIMENTS.intersection(names) else None
+    if workers <= 1:
+        return [timed_experiment(n, merged_data, engine) for n in names]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(timed_experiment, names, [merged_data] * len(names), [engine] * len(names)))
+
+
+def save_results(results, merged_data, path, results_name=RESULTS_NAME):
+    """
+    Writes every experiment's metrics to one JSON file
+    :param results: list from run_experiments()
+    :param merged_data: pandas df the experiments ran on
+    :param path: folder to write to
+    :param results_name: file name
+    :return: None
+    """
+    counts = merged_data['indicator'].value_counts()
+    summary = {
+        "rows": len(merged_data),
+        "columns": list(merged_data.columns),
+        "withdrawn_count": int(counts.get(0, 0)),
+        "in_service_count": int(counts.get(1, 0)),
+        "experiments": results,
+    }
+    with open(Path(path, results_name), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    print("Saved results to", Path(path, results_name))
+    return
+
+
+def main(model_choice=None, batch=None, workers=1):
     path = "/Users/derekwacks/Documents/Interconnection/code/data/training"
     f_names = ["NYISO_withdrawn.csv", "NYISO_inservice.csv",
                "ISONE_withdrawn.csv", "ISONE_inservice.csv",
@@ -91,8 +204,13 @@ def main(model_choice):
 
     #probs = create_probs(merged_data)
     #mdlhp.plotting(probs, labels=["Amenity Index", "Probability of Success"])
-    if model_choice == 0:
-        mdls.bayes(merged_data)
+    if batch is not None:  # batch mode: every requested experiment on this one data load
+        results = run_experiments(merged_data, batch or None, workers)
+        for r in results:
+            print("{:<20} {:>8.2f}s  {}".format(r["experiment"], r["seconds"], "ok" if r["error"] is None else "FAILED"))
+        save_results(results, merged_data, path)
+    elif model_choice == 0:
+        mdls.bayes(merged_data, ct.ContingencyEngine(merged_data))
     elif model_choice == 1:
         mdls.nb_param_selector_and_driver(merged_data)
     elif model_choice == 2:
@@ -108,7 +226,11 @@ def main(model_choice):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Train and test a selected model")
-    parser.add_argument("--model", required=True, type=int)
+    parser.add_argument("--model", type=int, help="single model choice in [0,4]")
+    parser.add_argument("--batch", nargs="*", help="run these experiments (all if none are listed) on one data load: "
+                                                   + ", ".join(EXPERIMENTS))
+    parser.add_argument("--workers", type=int, default=1, help="processes for --batch")
     args = parser.parse_args()
-    main(args.model)
-
+    if args.model is None and args.batch is None:
+        parser.error("choose --model or --batch")
+    main(args.model, args.batch, args.workers)
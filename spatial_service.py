@@ -0,0 +1,215 @@
+"""
+spatial_service.py
+Local read-only HTTP service answering spatial queries over the located projects (locs.feather)
+~ * ~ * ~ * ~ *
+GET /bbox?west=..&south=..&east=..&north=..[&limit=..]  projects inside a bounding box
+GET /nearest?lon=..&lat=..[&k=..]                        closest projects to a point, with distance in km
+GET /project?id=..                                       one project by id
+every answer is a JSON list (or object) of full project records, so the map only needs an id in each tile
+points are bucketed in a grid of cell_size degree cells for boxes and held in a KD-tree for nearest queries
+encoded responses are kept in an LRU cache
+"""
+import json
+import math
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from scipy.spatial import cKDTree
+import helpers as hp
+import county_gazetteer as gz
+import geojson_creator as gc
+
+EARTH_RADIUS_KM = 6371.0
+MAX_RESULTS = 1000
+
+
+def build_index(d_frame, cell_size=1.0):
+    """
+    :param d_frame: pandas dataframe from coordinate_locator.py (Longitude/Latitude or Locations, and project columns)
+    :param cell_size: grid cell width and height in degrees
+    :return: index dictionary: grid cell -> numpy array of rows, KD-tree, coordinates and JSON-ready records
+    """
+    lon, lat = gc.coordinate_arrays(d_frame)
+    located = ~(np.isnan(lon) | np.isnan(lat))
+    d_frame = d_frame.loc[located].drop(columns=['Locations', 'Merged'], errors='ignore').reset_index(drop=True)
+    lon, lat = lon[located], lat[located]
+    cells = {}
+    cell_x = np.floor(lon / cell_size).astype(np.int64)
+    cell_y = np.floor(lat / cell_size).astype(np.int64)
+    order = np.lexsort((cell_y, cell_x))
+    keys = np.column_stack([cell_x[order], cell_y[order]])
+    if len(order):
+        starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+        for rows in np.split(order, starts):
+            cells[(int(cell_x[rows[0]]), int(cell_y[rows[0]]))] = rows
+    columns = {col: d_frame[col].to_numpy(dtype=object) for col in d_frame.columns}
+    records = [dict({"id": i}, **{col: gc.json_value(values[i], False) for col, values in columns.items()})
+               for i in range(len(d_frame))]
+    return {
+        "cell_size": cell_size,
+        "cells": cells,
+        "lon": lon,
+        "lat": lat,
+        "tree": cKDTree(gz.to_unit_vectors(lat, lon)) if len(lon) else None,
+        "records": records,
+    }
+
+
+def bbox_rows(index, west, south, east, north):
+    """
+    :param index: dictionary from build_index()
+    :param west: west edge longitude (greater than east if the box crosses the antimeridian)
+    :param south: south edge latitude
+    :param east: east edge longitude
+    :param north: north edge latitude
+    :return: sorted numpy array of the rows inside the box
+    edges are clamped to [-180, 180] x [-90, 90] so the grid scan stays bounded
+    """
+    west, east = (min(max(v, -180.0), 180.0) for v in (west, east))
+    south, north = (min(max(v, -90.0), 90.0) for v in (south, north))
+    if west > east:
+        return np.union1d(bbox_rows(index, west, south, 180.0, north), bbox_rows(index, -180.0, south, east, north))
+    size = index["cell_size"]
+    candidates = [index["cells"][(x, y)]
+                  for x in range(math.floor(west / size), math.floor(east / size) + 1)
+                  for y in range(math.floor(south / size), math.floor(north / size) + 1)
+                  if (x, y) in index["cells"]]
+    if not candidates:
+        return np.array([], dtype=np.int64)
+    rows = np.concatenate(candidates)
+    lon, lat = index["lon"][rows], index["lat"][rows]
+    inside = (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+    return np.sort(rows[inside])
+
+
+def bbox_query(index, west, south, east, north, limit=MAX_RESULTS):
+    """
+    :param index: dictionary from build_index()
+    :param west, south, east, north: box edges in degrees
+    :param limit: maximum number of records returned
+    :return: dictionary with the number of projects in the box and up to limit records
+    """
+    rows = bbox_rows(index, west, south, east, north)
+    return {"count": len(rows), "projects": [index["records"][r] for r in rows[:limit]]}
+
+
+def nearest_query(index, lon, lat, k=5):
+    """
+    :param index: dictionary from build_index()
+    :param lon: query longitude
+    :param lat: query latitude
+    :param k: number of projects
+    :return: list of records, closest first, each with distance_km
+    """
+    if index["tree"] is None:
+        return []
+    k = min(k, len(index["records"]))
+    chord, rows = index["tree"].query(gz.to_unit_vectors([lat], [lon]), k=k)
+    chord, rows = np.atleast_1d(chord.ravel()), np.atleast_1d(rows.ravel())
+    distance_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+    return [dict(index["records"][r], distance_km=round(float(d), 3)) for r, d in zip(rows, distance_km)]
+
+
+def finite(params, name):
+    """
+    :param params: dictionary of query parameters
+    :param name: parameter name
+    :return: parameter as a float
+    raises ValueError if it is NaN or infinite
+    """
+    value = float(params[name])
+    if not math.isfinite(value):
+        raise ValueError("{} must be a finite number".format(name))
+    return value
+
+
+def answer(index, path, params):
+    """
+    :param index: dictionary from build_index()
+    :param path: request path ("/bbox", "/nearest" or "/project")
+    :param params: dictionary of query parameters
+    :return: (HTTP status code, JSON-ready body)
+    """
+    try:
+        if path == "/bbox":
+            return 200, bbox_query(index, finite(params, "west"), finite(params, "south"), finite(params, "east"),
+                                   finite(params, "north"), min(int(params.get("limit", MAX_RESULTS)), MAX_RESULTS))
+        if path == "/nearest":
+            return 200, nearest_query(index, finite(params, "lon"), finite(params, "lat"),
+                                      min(int(params.get("k", 5)), MAX_RESULTS))
+        if path == "/project":
+            row = int(params["id"])
+            if 0 <= row < len(index["records"]):
+                return 200, index["records"][row]
+            return 404, {"error": "no project {}".format(row)}
+    except (KeyError, ValueError, OverflowError) as e:
+        return 400, {"error": "bad or missing parameter: {}".format(e)}
+    return 404, {"error": "unknown path {}".format(path)}
+
+
+def make_handler(index, cache_size=1024):
+    """
+    :param index: dictionary from build_index()
+    :param cache_size: number of encoded responses to keep
+    :return: request handler class for http.server
+    """
+    @lru_cache(maxsize=cache_size)
+    def respond(path, query):
+        status, body = answer(index, path, dict(query))
+        return status, json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    class SpatialHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = tuple(sorted(parse_qsl(url.query)))  # same parameters in any order hit the same cache entry
+            status, body = respond(url.path.rstrip("/"), query)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Access-Control-Allow-Origin", "*")  # the frontend runs on another port
+            self.send_header("Cache-Control", "public, max-age=300")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # quiet; the map sends many requests
+            return
+
+    return SpatialHandler
+
+
+def serve(d_frame, host="127.0.0.1", port=8765, cell_size=1.0, cache_size=1024):
+    """
+    :param d_frame: pandas dataframe from coordinate_locator.py
+    :param host: address to listen on
+    :param port: port to listen on
+    :param cell_size: grid cell size in degrees
+    :param cache_size: number of encoded responses to keep
+    :return: None (runs until interrupted)
+    """
+    index = build_index(d_frame, cell_size)
+    server = ThreadingHTTPServer((host, port), make_handler(index, cache_size))
+    print("Serving {} projects on http://{}:{}".format(len(index["records"]), host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return
+
+
+def main():
+    path_to_data = "/Users/derekwacks/Documents/Interconnection/code/data/"
+    if Path(path_to_data, hp.LOCS_NAME).exists():
+        d_frame = pd.read_feather(Path(path_to_data, hp.LOCS_NAME))
+    else:  # legacy locs.csv with "[long, lat]" strings
+        d_frame = pd.read_csv(Path(path_to_data, "locs.csv"))
+    serve(d_frame)
+    return
+
+
+if __name__ == "__main__":
+    main()
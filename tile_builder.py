@@ -0,0 +1,279 @@
+"""
+tile_builder.py
+Builds a local MBTiles archive of Mapbox Vector Tiles for the interconnection map, run after geojson_creator.py
+~ * ~ * ~ * ~ *
+project every located project to Web Mercator
+below max_zoom, group points into grid cells (GRID_SIZE cells across each tile) and keep one cluster point per cell
+with its point count and counts per status and ISO
+at max_zoom, keep every project with its popup properties
+encode each tile as a Mapbox Vector Tile (points only), gzip it and store it in SQLite
+the same input always gives the same tiles: features are sorted, gzip timestamps are zeroed
+"""
+import gzip
+import json
+import math
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import helpers as hp
+import geojson_creator as gc
+
+LAYER_NAME = "interconnection"  # layer queried by the frontend (App.js)
+TILES_NAME = "interconnection.mbtiles"
+EXTENT = 4096  # tile coordinate range
+GRID_SIZE = 32  # cluster cells across a tile (ex: 32 cells of 16px on a 512px tile)
+MAX_LATITUDE = 85.0511287798  # Web Mercator limit
+
+
+def mercator(lon, lat):
+    """
+    :param lon: numpy array of longitudes
+    :param lat: numpy array of latitudes
+    :return: (x, y) numpy arrays in [0, 1), origin at the top left corner of the world
+    """
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0
+    return np.clip(x, 0.0, 1.0 - 1e-12), np.clip(y, 0.0, 1.0 - 1e-12)
+
+
+def category_codes(d_frame, col):
+    """
+    :param d_frame: pandas dataframe
+    :param col: category column (ex: "Status"), "Unknown" for every row if it doesn't exist
+    :return: (numpy array of codes, list of sorted category names)
+    """
+    values = d_frame[col] if col in d_frame.columns else pd.Series("Unknown", index=d_frame.index)
+    codes, names = pd.factorize(values.fillna("Unknown").astype(str), sort=True)
+    return codes, list(names)
+
+
+def load_points(d_frame, status_col="Status", iso_col="ISO"):
+    """
+    :param d_frame: pandas dataframe with Longitude/Latitude (or Locations) and the geojson_creator.PROPERTY_COLUMNS
+    :param status_col: column with the queue status (active, withdrawn, ...)
+    :param iso_col: column with the ISO name
+    :return: dictionary of numpy arrays (x, y, status and iso codes, properties) for the located rows
+    """
+    lon, lat = gc.coordinate_arrays(d_frame)
+    located = ~(np.isnan(lon) | np.isnan(lat))
+    d_frame = d_frame.loc[located].reset_index(drop=True)
+    x, y = mercator(lon[located], lat[located])
+    status, statuses = category_codes(d_frame, status_col)
+    iso, isos = category_codes(d_frame, iso_col)
+    properties = {prop: ([gc.json_value(v, as_str) for v in d_frame[col]] if col in d_frame.columns
+                         else [None] * len(d_frame))
+                  for prop, (col, as_str) in gc.PROPERTY_COLUMNS.items()}
+    properties["Status"] = [statuses[c] for c in status]
+    properties["ISO"] = [isos[c] for c in iso]
+    return {"x": x, "y": y, "status": status, "statuses": statuses, "iso": iso, "isos": isos,
+            "properties": properties}
+
+
+def cluster_points(points, zoom):
+    """
+    Grid clustering: every point in the same cell of a (2^zoom * GRID_SIZE)^2 grid joins one cluster
+    :param points: dictionary from load_points()
+    :param zoom: zoom level
+    :return: list of (x, y, properties) for each cluster, sorted by cell
+    """
+    cells = (1 << zoom) * GRID_SIZE
+    cell = (np.floor(points["x"] * cells).astype(np.int64) * cells + np.floor(points["y"] * cells).astype(np.int64))
+    cell_ids, group, counts = np.unique(cell, return_inverse=True, return_counts=True)
+    group = group.ravel()
+    n_groups = len(cell_ids)
+    x = np.bincount(group, weights=points["x"], minlength=n_groups) / counts
+    y = np.bincount(group, weights=points["y"], minlength=n_groups) / counts
+    first = np.full(n_groups, len(group), dtype=np.int64)
+    np.minimum.at(first, group, np.arange(len(group)))
+    by_category = {}
+    for kind, names in [("status", points["statuses"]), ("iso", points["isos"])]:
+        table = np.bincount(group * len(names) + points[kind], minlength=n_groups * len(names))
+        by_category[kind] = (names, table.reshape(n_groups, len(names)))
+    clusters = []
+    for g in range(n_groups):
+        if counts[g] == 1:  # lone project: show it as itself
+            i = first[g]
+            props = {k: v[i] for k, v in points["properties"].items()}
+            clusters.append((points["x"][i], points["y"][i], props))
+            continue
+        props = {"cluster": True, "point_count": int(counts[g])}
+        for kind, (names, table) in by_category.items():
+            for j, name in enumerate(names):
+                if table[g, j]:
+                    props["{}_{}".format(kind, name)] = int(table[g, j])
+        clusters.append((x[g], y[g], props))
+    return clusters
+
+
+def single_points(points):
+    """
+    :param points: dictionary from load_points()
+    :return: list of (x, y, properties) for every project
+    """
+    return [(points["x"][i], points["y"][i], {k: v[i] for k, v in points["properties"].items()})
+            for i in range(len(points["x"]))]
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number, wire_type, payload):
+    """
+    :param number: protobuf field number
+    :param wire_type: 0 for varints, 2 for length-delimited payloads
+    :param payload: int for varints, bytes for length-delimited
+    :return: encoded protobuf field
+    """
+    key = varint((number << 3) | wire_type)
+    if wire_type == 0:
+        return key + varint(payload)
+    return key + varint(len(payload)) + payload
+
+
+def encode_value(value):
+    """
+    :param value: property value (str, bool, int or float)
+    :return: encoded vector tile Value message
+    """
+    if isinstance(value, bool):
+        return field(7, 0, int(value))
+    if isinstance(value, int):
+        return field(5, 0, value) if value >= 0 else field(6, 0, zigzag(value) & 0xFFFFFFFFFFFFFFFF)
+    if isinstance(value, float):
+        return varint((3 << 3) | 1) + np.float64(value).tobytes()  # double, fixed 64 bit little endian
+    return field(1, 2, str(value).encode("utf-8"))
+
+
+def encode_tile(features, name=LAYER_NAME, extent=EXTENT):
+    """
+    Encodes one layer of point features as a Mapbox Vector Tile (spec version 2)
+    :param features: list of (tile x, tile y, properties) with x and y in [0, extent)
+    :param name: layer name
+    :param extent: tile coordinate range
+    :return: tile bytes (uncompressed)
+    """
+    keys, values = {}, {}
+    encoded_features = bytearray()
+    for fid, (x, y, props) in enumerate(features, start=1):
+        tags = []
+        for k, v in props.items():
+            if v is None:  # vector tiles have no null
+                continue
+            value_key = (type(v).__name__, v)
+            tags += [keys.setdefault(k, len(keys)), values.setdefault(value_key, len(values))]
+        geometry = varint(9) + varint(zigzag(int(x))) + varint(zigzag(int(y)))  # MoveTo(1), x, y
+        feature = field(1, 0, fid)
+        if tags:
+            feature += field(2, 2, b"".join(varint(t) for t in tags))
+        feature += field(3, 0, 1) + field(4, 2, geometry)  # type POINT
+        encoded_features += field(2, 2, feature)
+    layer = field(15, 0, 2) + field(1, 2, name.encode("utf-8")) + bytes(encoded_features)
+    layer += b"".join(field(3, 2, k.encode("utf-8")) for k in keys)
+    layer += b"".join(field(4, 2, encode_value(v)) for _, v in values)
+    layer += field(5, 0, extent)
+    return field(3, 2, layer)
+
+
+def tiles_for_zoom(items, zoom, extent=EXTENT):
+    """
+    :param items: list of (x, y, properties) in world coordinates [0, 1)
+    :param zoom: zoom level
+    :param extent: tile coordinate range
+    :return: dictionary (tile column, tile row) -> list of (tile x, tile y, properties), in sorted tile order
+    """
+    scale = 1 << zoom
+    tiles = {}
+    for x, y, props in items:
+        tx, ty = int(x * scale), int(y * scale)
+        px = min(int((x * scale - tx) * extent), extent - 1)
+        py = min(int((y * scale - ty) * extent), extent - 1)
+        tiles.setdefault((tx, ty), []).append((px, py, props))
+    return dict(sorted(tiles.items()))
+
+
+def create_mbtiles(out_path):
+    """
+    :param out_path: path of the MBTiles file to create
+    :return: sqlite3 connection with the MBTiles tables
+    """
+    conn = sqlite3.connect(out_path)
+    conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    conn.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    return conn
+
+
+def build_tiles(d_frame, out_path, min_zoom=0, max_zoom=12, status_col="Status", iso_col="ISO"):
+    """
+    Writes the clustered vector tiles for every zoom level to an MBTiles archive (replacing any existing file)
+    :param d_frame: pandas dataframe from coordinate_locator.py (Longitude/Latitude and project columns)
+    :param out_path: path of the MBTiles file
+    :param min_zoom: lowest zoom level
+    :param max_zoom: highest zoom level, where projects are not clustered
+    :param status_col: column with the queue status
+    :param iso_col: column with the ISO name
+    :return: dictionary zoom -> number of tiles written
+    """
+    points = load_points(d_frame, status_col, iso_col)
+    tmp_path = Path(str(out_path) + ".{}.tmp".format(os.getpid()))
+    tmp_path.unlink(missing_ok=True)
+    conn = create_mbtiles(tmp_path)
+    written = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        items = single_points(points) if zoom == max_zoom else cluster_points(points, zoom)
+        rows = []
+        for (tx, ty), features in tiles_for_zoom(items, zoom).items():
+            data = gzip.compress(encode_tile(features), mtime=0)
+            rows.append((zoom, tx, (1 << zoom) - 1 - ty, data))  # MBTiles rows count from the bottom (TMS)
+        conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+        written[zoom] = len(rows)
+        print("Zoom {}: {} features in {} tiles".format(zoom, len(items), len(rows)))
+    fields = {k: "String" for k in gc.PROPERTY_COLUMNS}
+    fields.update({"Status": "String", "ISO": "String", "cluster": "Boolean", "point_count": "Number"})
+    fields.update({"status_" + s: "Number" for s in points["statuses"]})
+    fields.update({"iso_" + s: "Number" for s in points["isos"]})
+    metadata = {
+        "name": LAYER_NAME,
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "bounds": "-180.0,-85.0511,180.0,85.0511",
+        "json": json.dumps({"vector_layers": [{"id": LAYER_NAME, "fields": fields,
+                                               "minzoom": min_zoom, "maxzoom": max_zoom}]}, sort_keys=True),
+    }
+    conn.executemany("INSERT INTO metadata VALUES (?, ?)", sorted(metadata.items()))
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, out_path)
+    return written
+
+
+def main(min_zoom=0, max_zoom=12):
+    path_to_data = "/Users/derekwacks/Documents/Interconnection/code/data/"
+    if Path(path_to_data, hp.LOCS_NAME).exists():
+        d_frame = pd.read_feather(Path(path_to_data, hp.LOCS_NAME))
+    else:  # legacy locs.csv with "[long, lat]" strings
+        d_frame = pd.read_csv(Path(path_to_data, "locs.csv"))
+    build_tiles(d_frame, Path(path_to_data, TILES_NAME), min_zoom, max_zoom)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+tileset_publisher.py
+Publishes one Mapbox tileset per ISO and status from the interconnection geojson, several at a time
+~ * ~ * ~ * ~ *
+split the features by their ISO and Status properties and write one geojson file per group
+for each group (at most `concurrency` in flight): stage the file in S3, submit the upload job,
+then poll the job's status with exponential backoff until it completes, fails or times out
+print a report of every tileset
+"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+from pathlib import Path
+import geojson_publisher as gp
+
+SPLIT_FOLDER = "tilesets"
+MAX_TILESET_NAME = 32  # Mapbox tileset name limit
+
+
+def tileset_name(parts, prefix="interconnection"):
+    """
+    :param parts: group values (ex: ("NYISO", "active"))
+    :param prefix: start of every tileset name
+    :return: Mapbox-safe tileset name (ex: "interconnection_NYISO_active"); names over MAX_TILESET_NAME are cut
+    and end in a short hash of the full name, so long names sharing a prefix stay distinct
+    """
+    name = "_".join([prefix] + [re.sub(r'[^A-Za-z0-9-]+', '-', str(p)).strip("-") for p in parts])
+    if len(name) <= MAX_TILESET_NAME:
+        return name
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+    return name[:MAX_TILESET_NAME - len(digest) - 1] + "_" + digest
+
+
+def split_features(features, by=("ISO", "Status")):
+    """
+    :param features: list of GeoJSON feature dictionaries
+    :param by: properties to group on ("Unknown" where a feature doesn't have one)
+    :return: dictionary tileset name -> list of features, sorted by name
+    raises ValueError if two different groups get the same tileset name (ex: "Pre-Queue" and "Pre Queue")
+    """
+    groups = {}
+    group_parts = {}
+    for feature in features:
+        parts = tuple(feature["properties"].get(p) or "Unknown" for p in by)
+        name = tileset_name(parts)
+        if group_parts.setdefault(name, parts) != parts:
+            raise ValueError("groups {} and {} would share tileset {}".format(group_parts[name], parts, name))
+        groups.setdefault(name, []).append(feature)
+    return dict(sorted(groups.items()))
+
+
+def write_groups(groups, path):
+    """
+    :param groups: dictionary from split_features()
+    :param path: data folder; files are written to <path>/tilesets
+    :return: dictionary tileset name -> file name relative to path
+    """
+    Path(path, SPLIT_FOLDER).mkdir(parents=True, exist_ok=True)
+    files = {}
+    for name, features in groups.items():
+        files[name] = str(Path(SPLIT_FOLDER, name + ".geojson"))
+        with open(Path(path, files[name]), 'w', encoding='utf-8') as f:
+            json.dump({"type": "FeatureCollection", "features": features}, f, ensure_ascii=False,
+                      separators=(",", ":"))
+    return files
+
+
+async def wait_for_upload(upload_id, base_url=None, **poll_kwargs):
+    """
+    :param upload_id: "id" from the publish() response
+    :param base_url: uploads API host (defaults to geojson_publisher.MAPBOX_API_URL)
+    :param poll_kwargs: keyword arguments for geojson_publisher.wait_for_upload() (poll_interval, max_interval, timeout)
+    :return: last upload status dictionary (with "error" set if the job failed or timed out)
+    """
+    return await asyncio.to_thread(gp.wait_for_upload, upload_id, base_url, **poll_kwargs)
+
+
+async def publish_tileset(name, file_name, path, semaphore, get_creds, staged_keys, s3_client=None, base_url=None,
+                          **poll_kwargs):
+    """
+    Stages, submits and waits for one tileset upload
+    :param name: tileset name
+    :param file_name: geojson file, relative to path
+    :param path: data folder
+    :param semaphore: asyncio.Semaphore capping the jobs in flight
+    :param get_creds: function returning AWS credentials from Mapbox, with a new staging key on every call
+    :param staged_keys: set of (bucket, key) already used by the other tilesets in this run
+    :param s3_client: boto3 S3 client, or None to build one from the credentials
+    :param base_url: uploads API host (defaults to geojson_publisher.MAPBOX_API_URL)
+    :param poll_kwargs: keyword arguments for wait_for_upload()
+    :return: report dictionary for the tileset
+    """
+    report = {"tileset": name, "file": file_name, "upload_id": None, "seconds": 0.0, "error": None}
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            creds = await asyncio.to_thread(get_creds)
+            staging = (creds["bucket"], creds["key"])
+            if staging in staged_keys:  # another tileset's file would be overwritten before Mapbox reads it
+                raise ValueError("staging key {}/{} is already used by another tileset".format(*staging))
+            staged_keys.add(staging)
+            await asyncio.to_thread(gp.copy_to_s3, path, file_name, creds, s3_client)
+            response = await asyncio.to_thread(gp.publish, creds, name, name, base_url)
+            if not response or "id" not in response:
+                report["error"] = "upload not accepted: {}".format(response)
+            else:
+                report["upload_id"] = response["id"]
+                await asyncio.to_thread(gp.mark_published, path, file_name, response["id"])
+                status = await wait_for_upload(response["id"], base_url, **poll_kwargs)
+                report["error"] = status.get("error")
+        except Exception as e:  # one failed tileset shouldn't stop the others
+            report["error"] = "{}: {}".format(type(e).__name__, e)
+        report["seconds"] = time.perf_counter() - start
+    return report
+
+
+async def publish_tilesets(path, file_name, by=("ISO", "Status"), concurrency=3, get_creds=None, s3_client=None,
+                           base_url=None, **poll_kwargs):
+    """
+    :param path: data folder
+    :param file_name: geojson file from geojson_creator.py
+    :param by: properties to split tilesets on
+    :param concurrency: maximum number of tilesets being staged, submitted or processed at once
+    :param get_creds: function returning AWS credentials from Mapbox (defaults to get_aws_creds(renew=True))
+    :param s3_client: boto3 S3 client, or None to build one from the credentials
+    :param base_url: uploads API host (defaults to geojson_publisher.MAPBOX_API_URL)
+    :param poll_kwargs: keyword arguments for wait_for_upload()
+    :return: list of report dictionaries, one per tileset
+    """
+    get_creds = get_creds or (lambda: gp.get_aws_creds(renew=True))
+    groups = split_features(gp.read_features(Path(path, file_name)), by)
+    files = write_groups(groups, path)
+    print("Publishing {} tilesets, {} at a time".format(len(files), concurrency))
+    semaphore = asyncio.Semaphore(concurrency)
+    staged_keys = set()
+    return await asyncio.gather(*(publish_tileset(name, f, path, semaphore, get_creds, staged_keys, s3_client,
+                                                  base_url, **poll_kwargs) for name, f in files.items()))
+
+
+def report_publishing(reports):
+    """
+    Prints the outcome of every tileset
+    :param reports: list of report dictionaries from publish_tilesets()
+    :return: number of tilesets that failed
+    """
+    failed = 0
+    for r in reports:
+        status = "ok" if r["error"] is None else "FAILED"
+        print("{:<34} {:>8.1f}s  {}".format(r["tileset"], r["seconds"], status))
+        if r["error"] is not None:
+            failed += 1
+            print("   ", r["error"])
+    print("{} tilesets, {} failed".format(len(reports), failed))
+    return failed
+
+
+def run_publish(path, file_name, **kwargs):
+    """
+    Synchronous wrapper for publish_tilesets()
+    :param path: data folder
+    :param file_name: geojson file from geojson_creator.py
+    :param kwargs: keyword arguments for publish_tilesets()
+    :return: list of report dictionaries
+    """
+    reports = asyncio.run(publish_tilesets(path, file_name, **kwargs))
+    report_publishing(reports)
+    return reports
+
+
+def main():
+    path = "/Users/derekwacks/Documents/Interconnection/code/data"
+    file_name = "interconnection.geojson"
+    run_publish(path, file_name)
+    return
+
+
+if __name__ == "__main__":
+    main()